@@ -0,0 +1,174 @@
+import os
+import math
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+from flask import request, jsonify
+
+from admission.backends import InMemoryBackend, PostgresBackend
+from metrics.metrics import registry, Counter, Gauge
+
+queue_depth = registry.register(Gauge(
+    "trainingwheels_admission_queue_depth", "Requests waiting for a concurrency slot.", ("limiter",)))
+in_flight = registry.register(Gauge(
+    "trainingwheels_admission_in_flight", "Admitted requests (or LLM/embedding calls) currently running.", ("limiter",)))
+rejections = registry.register(Counter(
+    "trainingwheels_admission_rejections_total", "Requests shed with 429, by limiter and reason.", ("limiter", "reason")))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, limiter, reason, retry_after):
+        super().__init__(f"{limiter} rejected ({reason}), retry after {retry_after:.2f}s")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    '''
+    Per-key admission control: a token bucket (rate, burst) in front of a concurrency limit with a bounded wait queue.
+
+    A request first needs a token, then one of max_concurrent slots. If every slot is taken it waits up to max_wait seconds,
+    unless max_queue requests for the same key are already waiting in this process, in which case it is shed immediately.
+    A rate of None disables the token bucket.
+    '''
+
+    def __init__(self, name, backend, max_concurrent, max_queue, max_wait, rate=None, burst=None):
+        self.name = name
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = burst or rate
+
+        self._lock = threading.Lock()
+        self._waiting = {}
+
+    def _reject(self, reason, retry_after):
+        rejections.inc(limiter=self.name, reason=reason)
+        raise AdmissionRejected(self.name, reason, retry_after)
+
+    def _wait_for_slot(self, slot_key, key):
+        with self._lock:
+            if self._waiting.get(key, 0) >= self.max_queue:
+                full = True
+            else:
+                full = False
+                self._waiting[key] = self._waiting.get(key, 0) + 1
+        if full:
+            self._reject("queue_full", self.max_wait)
+
+        queue_depth.inc(limiter=self.name)
+        try:
+            return self.backend.acquire_slot(slot_key, self.max_concurrent, self.max_wait)
+        finally:
+            queue_depth.dec(limiter=self.name)
+            with self._lock:
+                waiting = self._waiting[key] - 1
+                if waiting:
+                    self._waiting[key] = waiting
+                else:
+                    del self._waiting[key]
+
+    @contextmanager
+    def admit(self, key):
+        if self.rate:
+            retry_after = self.backend.take_token(f"{self.name}:rate:{key}", self.rate, self.burst)
+            if retry_after > 0:
+                self._reject("rate", retry_after)
+
+        slot_key = f"{self.name}:slots:{key}"
+        lease = self.backend.acquire_slot(slot_key, self.max_concurrent, 0)
+        if lease is None:
+            lease = self._wait_for_slot(slot_key, key)
+            if lease is None:
+                self._reject("timeout", self.max_wait)
+
+        in_flight.inc(limiter=self.name)
+        try:
+            yield
+        finally:
+            in_flight.dec(limiter=self.name)
+            self.backend.release_slot(slot_key, lease)
+
+
+def too_many_requests(error):
+    response = jsonify({"error": "Too many requests, please retry later"})
+    response.headers["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
+    return response, 429
+
+
+def admission_controlled(controller, get_key):
+    '''
+    Decorator admitting a Flask view through controller, keyed by get_key() (e.g. the user_id).
+
+    Rejections, including those of the global LLM/embedding call limits raised inside the view, become 429 responses.
+    Requests without a key are passed through so the view's own input validation can answer them.
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = get_key()
+            try:
+                if key is None:
+                    return view(*args, **kwargs)
+                with controller.admit(key):
+                    return view(*args, **kwargs)
+            except AdmissionRejected as error:
+                return too_many_requests(error)
+        return wrapper
+    return decorator
+
+
+def search_user_id():
+    return (request.get_json(silent=True) or {}).get("user_id")
+
+
+def upload_user_id():
+    return request.args.get("user_id")
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def build_backend():
+    '''
+    ADMISSION_BACKEND=postgres shares limits across workers through DATABASE_URI, the default "memory" is per process.
+    '''
+    if os.getenv("ADMISSION_BACKEND", "memory") == "postgres":
+        return PostgresBackend(os.getenv("DATABASE_URI"))
+    return InMemoryBackend()
+
+
+backend = build_backend()
+
+search_admission = AdmissionController(
+    "search", backend,
+    max_concurrent=int(_env_float("SEARCH_MAX_CONCURRENT", 4)),
+    max_queue=int(_env_float("SEARCH_MAX_QUEUE", 8)),
+    max_wait=_env_float("SEARCH_MAX_WAIT", 10),
+    rate=_env_float("SEARCH_RATE", 2), burst=_env_float("SEARCH_BURST", 10))
+
+upload_admission = AdmissionController(
+    "upload", backend,
+    max_concurrent=int(_env_float("UPLOAD_MAX_CONCURRENT", 2)),
+    max_queue=int(_env_float("UPLOAD_MAX_QUEUE", 2)),
+    max_wait=_env_float("UPLOAD_MAX_WAIT", 30),
+    rate=_env_float("UPLOAD_RATE", 0.5), burst=_env_float("UPLOAD_BURST", 5))
+
+# Global caps on in-flight calls to the shared OpenAI rate limit, across all tenants
+llm_calls = AdmissionController(
+    "llm_calls", backend,
+    max_concurrent=int(_env_float("MAX_INFLIGHT_LLM_CALLS", 16)),
+    max_queue=int(_env_float("MAX_QUEUED_LLM_CALLS", 64)),
+    max_wait=_env_float("LLM_CALL_MAX_WAIT", 30))
+
+embedding_calls = AdmissionController(
+    "embedding_calls", backend,
+    max_concurrent=int(_env_float("MAX_INFLIGHT_EMBEDDING_CALLS", 16)),
+    max_queue=int(_env_float("MAX_QUEUED_EMBEDDING_CALLS", 64)),
+    max_wait=_env_float("EMBEDDING_CALL_MAX_WAIT", 30))
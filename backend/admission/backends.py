@@ -0,0 +1,137 @@
+import os
+import time
+import uuid
+import threading
+
+from sqlalchemy import create_engine, text
+
+# Leases of crashed workers are reclaimed after this many seconds
+LEASE_TTL = int(os.getenv('ADMISSION_LEASE_TTL', 300))
+
+
+class InMemoryBackend:
+    '''
+    Token buckets and concurrency slots kept in process memory. Limits apply per worker process.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._buckets = {}
+        self._slots = {}
+
+    def take_token(self, key, rate, burst):
+        '''
+        Takes one token from the key's bucket. Returns 0 when granted, otherwise the seconds until a token is available.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def acquire_slot(self, key, limit, timeout):
+        '''
+        Acquires one of the key's limit slots, waiting up to timeout seconds. Returns a lease, or None if none freed up in time.
+        '''
+        deadline = time.monotonic() + timeout
+        with self._released:
+            while self._slots.get(key, 0) >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._released.wait(remaining)
+
+            self._slots[key] = self._slots.get(key, 0) + 1
+            return key
+
+    def release_slot(self, key, lease):
+        with self._released:
+            in_use = self._slots.get(key, 0) - 1
+            if in_use > 0:
+                self._slots[key] = in_use
+            else:
+                self._slots.pop(key, None)
+            self._released.notify_all()
+
+
+class PostgresBackend:
+    '''
+    Token buckets and concurrency slots shared by every worker through two small Postgres tables
+    (created by database/migrations.py).
+
+    Buckets are refilled and decremented in a single upsert; slots are leases with an expiry, so a crashed worker's
+    slots are reclaimed after LEASE_TTL seconds. Waiting for a slot polls with exponential backoff.
+    '''
+
+    def __init__(self, connection_uri):
+        self.engine = create_engine(connection_uri, pool_pre_ping=True)
+
+    def take_token(self, key, rate, burst):
+        with self.engine.begin() as connection:
+            granted = connection.execute(text('''
+                INSERT INTO admission_bucket (key, tokens, updated_at) VALUES (:key, :burst - 1, clock_timestamp())
+                ON CONFLICT (key) DO UPDATE SET
+                    tokens = LEAST(:burst, admission_bucket.tokens
+                        + EXTRACT(EPOCH FROM clock_timestamp() - admission_bucket.updated_at) * :rate) - 1,
+                    updated_at = clock_timestamp()
+                WHERE LEAST(:burst, admission_bucket.tokens
+                    + EXTRACT(EPOCH FROM clock_timestamp() - admission_bucket.updated_at) * :rate) >= 1
+                RETURNING tokens
+            '''), {"key": key, "rate": rate, "burst": burst}).first()
+
+            if granted is not None:
+                return 0.0
+
+            tokens = connection.execute(text('''
+                SELECT LEAST(:burst, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * :rate)
+                FROM admission_bucket WHERE key = :key
+            '''), {"key": key, "rate": rate, "burst": burst}).scalar()
+
+        return max((1 - float(tokens or 0)) / rate, 0.001)
+
+    def _try_acquire_slot(self, key, limit, holder):
+        with self.engine.begin() as connection:
+            return connection.execute(text('''
+                INSERT INTO admission_lease (key, slot, holder, expires_at)
+                SELECT :key, candidate.slot, :holder, clock_timestamp() + make_interval(secs => :ttl)
+                FROM generate_series(0, :limit - 1) AS candidate(slot)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM admission_lease
+                    WHERE admission_lease.key = :key AND admission_lease.slot = candidate.slot
+                        AND admission_lease.expires_at > clock_timestamp()
+                )
+                LIMIT 1
+                ON CONFLICT (key, slot) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+                WHERE admission_lease.expires_at <= clock_timestamp()
+                RETURNING slot
+            '''), {"key": key, "limit": limit, "holder": holder, "ttl": LEASE_TTL}).scalar()
+
+    def acquire_slot(self, key, limit, timeout):
+        deadline = time.monotonic() + timeout
+        holder = str(uuid.uuid4())
+        delay = 0.01
+
+        while True:
+            slot = self._try_acquire_slot(key, limit, holder)
+            if slot is not None:
+                return (slot, holder)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.25)
+
+    def release_slot(self, key, lease):
+        slot, holder = lease
+        with self.engine.begin() as connection:
+            connection.execute(text('''
+                DELETE FROM admission_lease WHERE key = :key AND slot = :slot AND holder = :holder
+            '''), {"key": key, "slot": slot, "holder": holder})
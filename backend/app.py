@@ -5,20 +5,25 @@ import langchain
 from dotenv import load_dotenv
 
 from database.database import db
+from database.migrations import run_migrations
 
 from chains.conversational_retrieval_chain_with_memory import build_conversational_retrieval_chain_with_memory
 from langchain.chat_models import ChatOpenAI
-from database.pg_vector_store import build_pg_vector_store
+from database.pg_vector_store import build_pg_vector_store, init_vector_schema
 from embeddings.openai_embeddings import openai_embeddings
 
 from routes.auth_routes import auth_routes_bp
 from routes.processing_routes import processing_routes_bp
 from routes.rag_routes import rag_routes_bp
+from routes.metrics_routes import metrics_routes_bp
+from routes.admin_routes import admin_routes_bp
+from profiling.profiler import init_profiling
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+# Paginated and cached responses carry these headers, which cross-origin clients can only read once exposed
+CORS(app, expose_headers=["X-Next-Cursor", "ETag"])
 
 langchain.verbose = True
 
@@ -26,12 +31,19 @@ langchain.verbose = True
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    # Session tokens issued at sign up and sign in are signed with it
+    raise RuntimeError("SECRET_KEY is not set")
 database_uri = os.getenv('DATABASE_URI')
 
 # Creating all tables
 with app.app_context():
     db.init_app(app)
     db.create_all()
+    run_migrations()
+
+# Vector extension and tables are created once here, vector stores built on the request path skip it
+init_vector_schema(database_uri)
 
 llm = ChatOpenAI()
 collection_name = "test"
@@ -50,8 +62,11 @@ def register_blueprints(app):
     app.register_blueprint(auth_routes_bp)
     app.register_blueprint(processing_routes_bp)
     app.register_blueprint(rag_routes_bp)
+    app.register_blueprint(metrics_routes_bp)
+    app.register_blueprint(admin_routes_bp)
 
 register_blueprints(app)
+init_profiling(app)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,121 @@
+'''
+Sign-in burst benchmark.
+
+Run from the backend directory:
+    python -m auth.benchmark_signin local [--rounds 12] [--burst 64]
+    python -m auth.benchmark_signin http --url http://localhost:5000 --email <email> --password <password> [--burst 64] [--concurrency 16]
+
+"local" compares checking a burst of passwords on the request threads against the bounded hashing pool, and the cost of
+verifying a session token. "http" fires a burst of concurrent /signin requests at a running server.
+'''
+import sys
+import time
+import argparse
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(name, latencies, elapsed, statuses=None):
+    print(f"{name:<28} {len(latencies) / elapsed:8.1f} req/s  p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms" + (f"  {dict(statuses)}" if statuses else ""))
+
+
+def run_burst(fn, burst, concurrency):
+    def timed_call(_):
+        started = time.perf_counter()
+        result = fn()
+        return time.perf_counter() - started, result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, range(burst)))
+    return [latency for latency, _ in results], [result for _, result in results], time.perf_counter() - started
+
+
+def benchmark_local(rounds, burst, concurrency):
+    import bcrypt
+    from auth.passwords import check_password, PASSWORD_HASH_WORKERS
+    from admission.admission_control import AdmissionRejected
+    from auth.session_tokens import issue_session_token, verify_session_token
+
+    password = "correct horse battery staple"
+    password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+    print(f"bcrypt cost {rounds}, burst of {burst} sign-ins from {concurrency} request threads, "
+          f"{PASSWORD_HASH_WORKERS} hashing workers")
+
+    latencies, _, elapsed = run_burst(
+        lambda: bcrypt.checkpw(password.encode(), password_hash.encode()), burst, concurrency)
+    report("check on request threads", latencies, elapsed)
+
+    def pooled_check():
+        try:
+            return "ok" if check_password(password_hash, password) else "invalid"
+        except AdmissionRejected:
+            return "shed (429)"
+
+    latencies, results, elapsed = run_burst(pooled_check, burst, concurrency)
+    report("check on hashing pool", latencies, elapsed, Counter(results))
+
+    class BenchmarkUser:
+        id = "benchmark-user"
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = "benchmark"
+    with app.app_context():
+        token = issue_session_token(BenchmarkUser)
+
+    def verify():
+        with app.app_context():
+            return verify_session_token(token)
+
+    latencies, _, elapsed = run_burst(verify, burst * 100, concurrency)
+    report("session token verify", latencies, elapsed)
+
+
+def benchmark_http(url, email, password, burst, concurrency):
+    import requests
+
+    session = requests.Session()
+    signin_url = url.rstrip('/') + "/signin"
+
+    def signin():
+        return session.post(signin_url, json={"email": email, "password": password}).status_code
+
+    latencies, statuses, elapsed = run_burst(signin, burst, concurrency)
+    report(f"POST {signin_url}", latencies, elapsed, Counter(statuses))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sign-in throughput under a burst of logins.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    local_parser = subparsers.add_parser("local")
+    local_parser.add_argument("--rounds", type=int, default=12)
+
+    http_parser = subparsers.add_parser("http")
+    http_parser.add_argument("--url", default="http://localhost:5000")
+    http_parser.add_argument("--email", required=True)
+    http_parser.add_argument("--password", required=True)
+
+    for subparser in (local_parser, http_parser):
+        subparser.add_argument("--burst", type=int, default=64)
+        subparser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.mode == "local":
+        benchmark_local(args.rounds, args.burst, args.concurrency)
+    else:
+        benchmark_http(args.url, args.email, args.password, args.burst, args.concurrency)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from admission.admission_control import AdmissionRejected
+from metrics.metrics import timed
+
+# bcrypt cost factor for new hashes; existing hashes with another cost are rehashed on the next successful login
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+
+# bcrypt releases the GIL, so a thread per core hashes in parallel; more would only oversubscribe the CPU
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+
+# Hashes allowed to wait for a worker before sign-ins are shed with a 429
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 4 * PASSWORD_HASH_WORKERS))
+
+hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
+
+
+def _run_in_pool(stage, fn, *args):
+    if not _pending.acquire(blocking=False):
+        raise AdmissionRejected("password_hash", "queue_full", 1.0)
+
+    try:
+        with timed(stage):
+            return hash_executor.submit(fn, *args).result()
+    finally:
+        _pending.release()
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
+
+
+def hash_password(password, rounds=None):
+    '''
+    Hashes a password on the bounded hashing pool. Raises AdmissionRejected when the pool's queue is full.
+    '''
+    return _run_in_pool("password_hash", _hash, password, rounds or BCRYPT_LOG_ROUNDS)
+
+
+def check_password(password_hash, password):
+    '''
+    Checks a password against its bcrypt hash on the bounded hashing pool (same hashes as flask_bcrypt).
+    '''
+    return _run_in_pool("password_check", _check, password_hash, password)
+
+
+def hash_rounds(password_hash):
+    # bcrypt hashes look like $2b$12$<salt and hash>
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(password_hash):
+    return hash_rounds(password_hash) != BCRYPT_LOG_ROUNDS
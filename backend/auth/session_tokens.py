@@ -0,0 +1,61 @@
+import os
+
+from flask import current_app, request, jsonify
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+# Lifetime of a session token in seconds
+SESSION_TOKEN_MAX_AGE = int(os.getenv('SESSION_TOKEN_MAX_AGE', 7 * 24 * 3600))
+
+# When set, requests carrying a user_id must also carry a session token for that user
+REQUIRE_SESSION_TOKEN = os.getenv('REQUIRE_SESSION_TOKEN') == '1'
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt="session-token")
+
+
+def issue_session_token(user):
+    return _serializer().dumps({"id": user.id})
+
+
+def verify_session_token(token):
+    '''
+    Returns the user id of a valid, unexpired session token and None otherwise.
+    Only checks the signature, so it costs neither a database query nor a bcrypt hash.
+    '''
+    try:
+        return _serializer().loads(token, max_age=SESSION_TOKEN_MAX_AGE).get("id")
+    except (SignatureExpired, BadSignature):
+        return None
+
+
+def request_session_token():
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):]
+    return None
+
+
+def check_session():
+    '''
+    before_request hook for blueprints whose routes take a user_id.
+
+    A request presenting a session token may only act for the token's user. Requests without a token are let through
+    unless REQUIRE_SESSION_TOKEN is set.
+    '''
+    user_id = request.args.get("user_id") or (request.get_json(silent=True) or {}).get("user_id")
+    if user_id is None:
+        return None
+
+    token = request_session_token()
+    if token is None:
+        if REQUIRE_SESSION_TOKEN:
+            return jsonify({ 'error': 'Missing session token' }), 401
+        return None
+
+    token_user_id = verify_session_token(token)
+    if token_user_id is None:
+        return jsonify({ 'error': 'Invalid or expired session token' }), 401
+    if token_user_id != user_id:
+        return jsonify({ 'error': 'Forbidden' }), 403
+    return None
@@ -0,0 +1,110 @@
+import re
+import threading
+from collections import OrderedDict
+
+from pydantic import ConfigDict
+
+from langchain.chains.base import Chain
+from langchain.chains.llm import LLMChain
+
+from metrics.metrics import record_cache, record_llm_call_saved
+
+# Words that only make sense with the previous turns in view (pronouns, deictics, "more", ...)
+REFERRING_WORDS = {
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "hers", "there", "then", "above", "previous", "earlier",
+    "former", "latter", "same", "more", "else", "again", "also", "one", "ones",
+}
+
+# Openings that continue the previous turn ("and why?", "what about ...", "how about ...")
+CONTINUATION_PREFIXES = ("and ", "but ", "so ", "or ", "also ", "what about", "how about", "why not", "ok ", "okay ")
+
+# Shorter questions are almost always follow-ups ("why?", "give an example")
+MIN_STANDALONE_WORDS = 5
+
+_WORD = re.compile(r"[a-z']+")
+
+
+def is_standalone_question(question):
+    '''
+    Cheap heuristic deciding whether a question can be used for retrieval as is, without rephrasing it against the chat history.
+
+    It errs on the side of condensing: any pronoun, deictic or continuation opening sends the question to the LLM.
+    '''
+    normalized = question.strip().lower()
+    words = _WORD.findall(normalized)
+
+    if len(words) < MIN_STANDALONE_WORDS:
+        return False
+    if normalized.startswith(CONTINUATION_PREFIXES):
+        return False
+    return not any(word in REFERRING_WORDS for word in words)
+
+
+class CondensedQuestionCache:
+    '''
+    Thread safe LRU cache of condensed questions keyed by the (recent) chat history and the follow-up question.
+    '''
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, chat_history, question):
+        key = (chat_history, question.strip().lower())
+        with self._lock:
+            rewrite = self._entries.get(key)
+            if rewrite is not None:
+                self._entries.move_to_end(key)
+            return rewrite
+
+    def put(self, chat_history, question, rewrite):
+        key = (chat_history, question.strip().lower())
+        with self._lock:
+            self._entries[key] = rewrite
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class CondenseQuestionChain(Chain):
+    '''
+    Drop-in question_generator for ConversationalRetrievalChain that only calls the condense LLM when it is needed.
+
+    Questions that already stand alone are passed through, and rewrites are served from the cache for repeated follow-ups.
+    '''
+
+    llm_chain: LLMChain
+    cache: CondensedQuestionCache
+    output_key: str = "text"
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def input_keys(self):
+        return ["question", "chat_history"]
+
+    @property
+    def output_keys(self):
+        return [self.output_key]
+
+    def _call(self, inputs, run_manager=None):
+        question = inputs["question"]
+        chat_history = inputs["chat_history"]
+
+        if is_standalone_question(question):
+            record_llm_call_saved("condense_question", "standalone")
+            return {self.output_key: question}
+
+        rewrite = self.cache.get(chat_history, question)
+        record_cache("condense_question", rewrite is not None)
+        if rewrite is not None:
+            record_llm_call_saved("condense_question", "cache")
+            return {self.output_key: rewrite}
+
+        callbacks = run_manager.get_child() if run_manager else None
+        rewrite = self.llm_chain.run(question=question, chat_history=chat_history, callbacks=callbacks)
+        self.cache.put(chat_history, question, rewrite)
+
+        return {self.output_key: rewrite}
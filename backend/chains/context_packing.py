@@ -0,0 +1,153 @@
+import os
+import re
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metrics.metrics import registry, Counter, Histogram
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 2000))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', 0.85))
+
+# Chunks whose character ranges are at most this far apart are treated as neighbours (the splitter strips whitespace)
+MAX_NEIGHBOUR_GAP = 2
+
+context_tokens = registry.register(Histogram(
+    "trainingwheels_context_tokens", "Context tokens per /search request, as retrieved and after packing.", ("stage",),
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)))
+context_chunks_dropped = registry.register(Counter(
+    "trainingwheels_context_chunks_dropped_total", "Retrieved chunks left out of the prompt, by reason.", ("reason",)))
+
+_WORD = re.compile(r"\w+")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text):
+    if _encoding is None:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if _encoding is None:
+        return text[:max_tokens * 4]
+    return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def _shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def merge_neighbours(docs):
+    '''
+    Merges chunks of the same source (and page) whose character ranges touch or overlap into a single document.
+
+    Needs the splitter's start_index and a source in the metadata; other chunks are kept as they are. Overlapping chunks
+    are only merged when the overlapping text matches, since offsets alone can come from different versions of a file.
+    Returns the documents in relevance order, a merged document taking the rank of its best chunk.
+    '''
+    groups = {}
+    standalone = []
+
+    for rank, doc in enumerate(docs):
+        start = doc.metadata.get("start_index")
+        if start is None or start < 0 or doc.metadata.get("source") is None:
+            standalone.append((rank, doc))
+        else:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            groups.setdefault(key, []).append((start, rank, doc))
+
+    merged = list(standalone)
+    for chunks in groups.values():
+        chunks.sort(key=lambda chunk: chunk[0])
+
+        start, rank, doc = chunks[0]
+        text, end = doc.page_content, start + len(doc.page_content)
+
+        for next_start, next_rank, next_doc in chunks[1:]:
+            overlap = max(0, end - next_start)
+            if next_start <= end + MAX_NEIGHBOUR_GAP and (
+                    not overlap or text[-overlap:] == next_doc.page_content[:overlap]):
+                separator = "" if overlap or next_start == end else " "
+                text += separator + next_doc.page_content[overlap:]
+                end = max(end, next_start + len(next_doc.page_content))
+                rank = min(rank, next_rank)
+            else:
+                merged.append((rank, Document(page_content=text, metadata={**doc.metadata, "start_index": start})))
+                start, rank, doc = next_start, next_rank, next_doc
+                text, end = doc.page_content, start + len(doc.page_content)
+
+        merged.append((rank, Document(page_content=text, metadata={**doc.metadata, "start_index": start})))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged]
+
+
+def drop_near_duplicates(docs, threshold=CONTEXT_DEDUP_THRESHOLD):
+    '''
+    Drops documents whose word shingles are mostly contained in a more relevant document already kept.
+    '''
+    kept = []
+    kept_shingles = []
+
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        duplicate = any(
+            len(shingles & other) / max(1, min(len(shingles), len(other))) >= threshold
+            for other in kept_shingles
+        )
+        if duplicate:
+            context_chunks_dropped.inc(reason="duplicate")
+            continue
+
+        kept.append(doc)
+        kept_shingles.append(shingles)
+
+    return kept
+
+
+def pack_context(docs, max_tokens=CONTEXT_TOKEN_BUDGET):
+    '''
+    Packs retrieved documents into a token budget: neighbouring chunks are merged, near-duplicates dropped, and the
+    remaining documents added in relevance order while they fit. The most relevant document is truncated rather than
+    dropped if it alone exceeds the budget.
+    '''
+    context_tokens.observe(sum(count_tokens(doc.page_content) for doc in docs), stage="retrieved")
+
+    packed = []
+    used = 0
+    for doc in drop_near_duplicates(merge_neighbours(docs)):
+        tokens = count_tokens(doc.page_content)
+
+        if used + tokens <= max_tokens:
+            packed.append(doc)
+            used += tokens
+        elif not packed:
+            packed.append(Document(page_content=truncate_to_tokens(doc.page_content, max_tokens), metadata=doc.metadata))
+            used = max_tokens
+        else:
+            context_chunks_dropped.inc(reason="budget")
+
+    context_tokens.observe(used, stage="packed")
+    return packed
+
+
+class ContextPackingRetriever(BaseRetriever):
+    '''
+    Wraps a retriever so the documents handed to the answer LLM are packed into a token budget (see pack_context).
+    '''
+
+    retriever: BaseRetriever
+    max_tokens: int = CONTEXT_TOKEN_BUDGET
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return pack_context(docs, self.max_tokens)
@@ -1,23 +1,90 @@
 from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import SQLChatMessageHistory
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_core.callbacks import BaseCallbackHandler
+import time
 import os
 
-def build_conversational_retrieval_chain_with_memory(llm, retriever, id):
+from metrics.metrics import observe_stage, errors
+from chains.condense_question_chain import CondenseQuestionChain, CondensedQuestionCache
+from chains.context_packing import ContextPackingRetriever
+
+# Only the most recent messages are given to the condense LLM (and used as the rewrite cache key)
+CONDENSE_HISTORY_MESSAGES = int(os.getenv('CONDENSE_HISTORY_MESSAGES', 6))
+
+# Shared across requests, since a chain is built per request
+condensed_question_cache = CondensedQuestionCache(max_size=int(os.getenv('CONDENSE_CACHE_SIZE', 1024)))
+
+
+class TimedConversationBufferMemory(ConversationBufferMemory):
+    '''
+    Conversation memory that records how long loading the history from message_store takes.
+    '''
+
+    def load_memory_variables(self, inputs):
+        started = time.perf_counter()
+        try:
+            return super().load_memory_variables(inputs)
+        finally:
+            observe_stage("memory_load", time.perf_counter() - started)
+
+
+def recent_chat_history(chat_history):
+    return _get_chat_history(chat_history[-CONDENSE_HISTORY_MESSAGES:])
+
+
+class ChainStageTimer(BaseCallbackHandler):
+    '''
+    Callback handler that records the wall time of the chain it is attached to as a /search stage.
+
+    Attached as a local (non inherited) callback, so only the chain's own start/end events are timed.
+    '''
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            observe_stage(self.stage, time.perf_counter() - started)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        errors.inc(where=self.stage)
+
+
+def build_conversational_retrieval_chain_with_memory(llm, retriever, id, condense_question_llm=None):
     # Memory is stored and sourced from SQL
     # All messages (Human and AI) are stored in the message_store table and are linked together via the session_id
     # To continue an existing conversation, pass in an existing session_id
     # To create a new conversation, pass in a new session_id
-    memory = ConversationBufferMemory(
+    memory = TimedConversationBufferMemory(
         chat_memory=SQLChatMessageHistory(session_id=str(id), connection_string=os.getenv('DATABASE_URI')),
         return_messages=True,
         memory_key="chat_history",
         output_key="answer"
     )
 
-    return ConversationalRetrievalChain.from_llm(
+    # A smaller/faster model can be used just for condensing follow-up questions
+    chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
         memory=memory,
-        retriever=retriever,
-        condense_question_llm=llm
-    )
\ No newline at end of file
+        # Retrieved chunks are merged, deduplicated and packed into a token budget before reaching the LLM
+        retriever=ContextPackingRetriever(retriever=retriever),
+        condense_question_llm=condense_question_llm or llm,
+        get_chat_history=recent_chat_history
+    )
+
+    # Time the condense-question and answer LLM calls separately
+    chain.question_generator.callbacks = [ChainStageTimer("condense_question")]
+    chain.combine_docs_chain.callbacks = [ChainStageTimer("answer_llm")]
+
+    # Skip the condense LLM for standalone questions and cached follow-ups
+    chain.question_generator = CondenseQuestionChain(llm_chain=chain.question_generator, cache=condensed_question_cache)
+
+    return chain
@@ -0,0 +1,13 @@
+from langchain.chat_models import ChatOpenAI
+
+from admission.admission_control import llm_calls
+
+
+class LimitedChatOpenAI(ChatOpenAI):
+    '''
+    ChatOpenAI whose calls go through the global cap on in-flight LLM calls shared by all tenants.
+    '''
+
+    def _generate(self, messages, stop=None, run_manager=None, stream=None, **kwargs):
+        with llm_calls.admit("global"):
+            return super()._generate(messages, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
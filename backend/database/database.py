@@ -1,8 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.types import UserDefinedType
+from sqlalchemy import func
 from flask_bcrypt import Bcrypt
 import uuid
+from datetime import datetime
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -30,6 +32,15 @@ class File(db.Model):
     id = db.Column(db.String(), primary_key=True, default=lambda: str(uuid.uuid4()))
     url = db.Column(db.String(), nullable=False)
     name = db.Column(db.String(), nullable=False)
+    # Blob storage path; files uploaded before per-upload paths are stored under their name
+    path = db.Column(db.String(), nullable=True)
     type = db.Column(db.String(), nullable=False)
+    size = db.Column(db.BigInteger(), nullable=True)
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=func.now())
 
-    user_id = db.Column(db.String(), db.ForeignKey('user.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.String(), db.ForeignKey('user.id'), nullable=False)
+
+    # Serves per-user lookups, aggregates and keyset pagination (newest first)
+    __table_args__ = (
+        db.Index('ix_file_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+from database.database import db, File
+from metrics.metrics import record_cache
+
+# Number of most recent files kept in a summary
+RECENT_FILES = 10
+
+# Summaries are only kept in this process, so other workers' uploads become visible after at most this many seconds
+FILE_SUMMARY_TTL = float(os.getenv('FILE_SUMMARY_TTL', 15))
+FILE_SUMMARY_CACHE_SIZE = int(os.getenv('FILE_SUMMARY_CACHE_SIZE', 10000))
+
+_lock = threading.Lock()
+_summaries = OrderedDict()
+
+
+def make_etag(payload):
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def file_to_dict(file):
+    return {
+        "id": file.id,
+        "url": file.url,
+        "name": file.name,
+        "type": file.type,
+        "size": file.size,
+        "created_at": file.created_at.isoformat() if file.created_at else None,
+    }
+
+
+def _with_etag(summary):
+    summary["etag"] = make_etag({key: value for key, value in summary.items() if key != "etag"})
+    return summary
+
+
+def build_file_summary(user_id):
+    '''
+    Computes a user's file summary with indexed SQL aggregates: counts and bytes by type, plus the most recent files.
+    '''
+    rows = db.session.query(File.type, func.count(File.id), func.coalesce(func.sum(File.size), 0)).filter(
+        File.user_id == user_id).group_by(File.type).all()
+
+    recent = db.session.query(File).filter(File.user_id == user_id).order_by(
+        File.created_at.desc(), File.id.desc()).limit(RECENT_FILES).all()
+
+    return _with_etag({
+        "counts": {file_type: count for file_type, count, _ in rows},
+        "file_count": sum(count for _, count, _ in rows),
+        "total_bytes": int(sum(size for _, _, size in rows)),
+        "recent_files": [file_to_dict(file) for file in recent],
+    })
+
+
+def get_file_summary(user_id):
+    '''
+    Returns the cached summary for a user, rebuilding it from the database when missing or older than FILE_SUMMARY_TTL.
+    '''
+    now = time.monotonic()
+    with _lock:
+        cached = _summaries.get(user_id)
+        if cached and now - cached[0] < FILE_SUMMARY_TTL:
+            _summaries.move_to_end(user_id)
+            record_cache("file_summary", True)
+            return cached[1]
+
+    record_cache("file_summary", False)
+    summary = build_file_summary(user_id)
+
+    with _lock:
+        _summaries[user_id] = (now, summary)
+        _summaries.move_to_end(user_id)
+        while len(_summaries) > FILE_SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+
+    return summary
+
+
+def record_file_added(user_id, file):
+    '''
+    Incrementally updates a cached summary after an upload instead of dropping it.
+    '''
+    with _lock:
+        cached = _summaries.get(user_id)
+        if cached is None:
+            return
+
+        loaded_at, summary = cached
+        counts = dict(summary["counts"])
+        counts[file.type] = counts.get(file.type, 0) + 1
+
+        _summaries[user_id] = (loaded_at, _with_etag({
+            "counts": counts,
+            "file_count": summary["file_count"] + 1,
+            "total_bytes": summary["total_bytes"] + (file.size or 0),
+            "recent_files": ([file_to_dict(file)] + summary["recent_files"])[:RECENT_FILES],
+        }))
+
+
+def invalidate_file_summary(user_id):
+    '''
+    Drops a user's cached summary, e.g. after deletes where the recent files list has to be re-read.
+    '''
+    with _lock:
+        _summaries.pop(user_id, None)
@@ -0,0 +1,228 @@
+'''
+In-process vector index for the hottest collections.
+
+A few tenants (embedded bots) send most /search queries. Once a collection gets HOT_INDEX_MIN_QUERIES queries within
+HOT_INDEX_WINDOW seconds, its rows are loaded in the background into a contiguous, L2-normalised float32 matrix, and
+later queries are answered with an exact cosine scan in memory instead of a pgvector query. Everyone else, and any
+query with a metadata filter, keeps going to Postgres.
+
+Loaded collections are evicted least recently used first to stay within HOT_INDEX_MEMORY_MB (0, the default, disables
+the index). Writes and deletes made through TimedPGVector in this process are applied to the loaded index directly;
+writes from other processes show up when the index is reloaded, HOT_INDEX_TTL seconds after it was loaded.
+'''
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import select
+from langchain_core.documents import Document
+
+from metrics.metrics import registry, Gauge, record_cache
+
+HOT_INDEX_MEMORY_MB = float(os.getenv('HOT_INDEX_MEMORY_MB', 0))
+HOT_INDEX_MIN_QUERIES = int(os.getenv('HOT_INDEX_MIN_QUERIES', 20))
+HOT_INDEX_WINDOW = float(os.getenv('HOT_INDEX_WINDOW', 300))
+HOT_INDEX_TTL = float(os.getenv('HOT_INDEX_TTL', 120))
+
+# Query counters kept for at most this many collections
+MAX_TRACKED_COLLECTIONS = 10000
+
+hot_index_bytes = registry.register(Gauge(
+    "trainingwheels_hot_index_bytes", "Memory used by the in-process index of hot collections."))
+hot_index_collections = registry.register(Gauge(
+    "trainingwheels_hot_index_collections", "Collections loaded in the in-process index."))
+
+
+def _normalise(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class CollectionIndex:
+    '''
+    Rows of one collection. Never modified in place: writes build a new CollectionIndex, so searches can run on the
+    instance they got without a lock.
+    '''
+
+    def __init__(self, ids, documents, metadatas, matrix, loaded_at):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.matrix = matrix
+        self.loaded_at = loaded_at
+        self.positions = {id: i for i, id in enumerate(ids)}
+        self.nbytes = matrix.nbytes + sum(len(document or "") for document in documents) + 200 * len(ids)
+
+    def search(self, embedding, k):
+        '''
+        Returns up to k (document, cosine distance, normalised vector) tuples, nearest first.
+        '''
+        if not self.ids:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = self.matrix @ query
+
+        k = min(k, len(self.ids))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+
+        return [
+            (Document(id=self.ids[i], page_content=self.documents[i], metadata=dict(self.metadatas[i])),
+             float(1.0 - similarities[i]), self.matrix[i])
+            for i in top
+        ]
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        replaced = set(ids)
+        keep = [i for i, id in enumerate(self.ids) if id not in replaced]
+        added = _normalise(np.asarray(embeddings, dtype=np.float32))
+        return CollectionIndex(
+            [self.ids[i] for i in keep] + list(ids),
+            [self.documents[i] for i in keep] + list(documents),
+            [self.metadatas[i] for i in keep] + list(metadatas),
+            np.vstack([self.matrix[keep], added]) if keep else added,
+            self.loaded_at,
+        )
+
+    def remove(self, ids):
+        ids = set(ids)
+        keep = [i for i, id in enumerate(self.ids) if id not in ids]
+        return CollectionIndex(
+            [self.ids[i] for i in keep], [self.documents[i] for i in keep], [self.metadatas[i] for i in keep],
+            self.matrix[keep], self.loaded_at)
+
+
+class HotIndex:
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._queries = {}
+        self._loading = set()
+        # Loads that raced with a write, whose result is discarded
+        self._stale_loads = set()
+        self._too_large = set()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hot-index")
+
+    @property
+    def enabled(self):
+        return self.memory_budget > 0
+
+    def _is_hot(self, key, now):
+        window_start, count = self._queries.get(key, (now, 0))
+        if now - window_start > HOT_INDEX_WINDOW:
+            window_start, count = now, 0
+
+        if len(self._queries) >= MAX_TRACKED_COLLECTIONS and key not in self._queries:
+            self._queries.clear()
+        self._queries[key] = (window_start, count + 1)
+        return count + 1 >= HOT_INDEX_MIN_QUERIES
+
+    def lookup(self, key, store):
+        '''
+        Returns the loaded index of the collection, or None to fall back to pgvector.
+
+        Counts the query towards the collection's hotness and schedules a (re)load when it is hot and not loaded or
+        older than HOT_INDEX_TTL.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+
+            hot = self._is_hot(key, now)
+            stale = index is None or now - index.loaded_at > HOT_INDEX_TTL
+            if hot and stale and key not in self._loading and key not in self._too_large:
+                self._loading.add(key)
+                self._loader.submit(self._load, key, store)
+
+        record_cache("hot_index", index is not None)
+        return index
+
+    def _load(self, key, store):
+        try:
+            started = time.monotonic()
+            with store._make_sync_session() as session:
+                collection = store.get_collection(session)
+                if collection is None:
+                    return
+                EmbeddingStore = store.EmbeddingStore
+                rows = session.execute(
+                    select(EmbeddingStore.id, EmbeddingStore.document, EmbeddingStore.cmetadata, EmbeddingStore.embedding)
+                    .where(EmbeddingStore.collection_id == collection.uuid)
+                ).all()
+
+            if rows:
+                matrix = _normalise(np.array([row.embedding for row in rows], dtype=np.float32))
+            else:
+                matrix = np.empty((0, store._embedding_length or 0), dtype=np.float32)
+            index = CollectionIndex(
+                [str(row.id) for row in rows], [row.document for row in rows], [row.cmetadata or {} for row in rows],
+                matrix, started)
+
+            with self._lock:
+                if key in self._stale_loads:
+                    return
+                if index.nbytes > self.memory_budget:
+                    self._too_large.add(key)
+                    self._indexes.pop(key, None)
+                else:
+                    self._indexes[key] = index
+                    self._indexes.move_to_end(key)
+                    self._evict()
+        except Exception as e:
+            print(f"Error loading hot index for collection {key[1]}: {e}")
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+                self._stale_loads.discard(key)
+
+    def _evict(self):
+        # Called with the lock held
+        while sum(index.nbytes for index in self._indexes.values()) > self.memory_budget:
+            self._indexes.popitem(last=False)
+        hot_index_bytes.set(sum(index.nbytes for index in self._indexes.values()))
+        hot_index_collections.set(len(self._indexes))
+
+    def _mark_stale_load(self, key):
+        # Called with the lock held
+        if key in self._loading:
+            self._stale_loads.add(key)
+
+    def upsert(self, key, ids, documents, metadatas, embeddings):
+        with self._lock:
+            self._mark_stale_load(key)
+            index = self._indexes.get(key)
+            if index is None:
+                return
+            self._indexes[key] = index.upsert(ids, documents, metadatas, embeddings)
+            self._evict()
+
+    def remove(self, url, ids):
+        # Ids may be deleted without a collection (PGVector.delete), so every loaded collection of the database is checked
+        ids = list(ids)
+        with self._lock:
+            for key in self._loading:
+                if key[0] == url:
+                    self._mark_stale_load(key)
+            for key, index in list(self._indexes.items()):
+                if key[0] == url and any(id in index.positions for id in ids):
+                    self._indexes[key] = index.remove(ids)
+            self._evict()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._mark_stale_load(key)
+            self._indexes.pop(key, None)
+            self._too_large.discard(key)
+            self._evict()
+
+
+hot_index = HotIndex(HOT_INDEX_MEMORY_MB * 1024 * 1024)
@@ -0,0 +1,29 @@
+from sqlalchemy import text
+
+from database.database import db
+
+# db.create_all() only creates missing tables, so columns and indexes added to existing tables are applied here.
+# Every statement must be idempotent: they run on each startup.
+MIGRATIONS = [
+    # Dashboard read model: file sizes, upload time and keyset pagination index
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS size BIGINT",
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_file_user_id_created_at_id ON file (user_id, created_at, id)",
+    # Per-upload blob paths (storage/blob_store.py blob_path)
+    "ALTER TABLE file ADD COLUMN IF NOT EXISTS path VARCHAR",
+    # Shared admission control state (admission/backends.py PostgresBackend)
+    "CREATE TABLE IF NOT EXISTS admission_bucket ("
+    " key TEXT PRIMARY KEY, tokens DOUBLE PRECISION NOT NULL, updated_at TIMESTAMPTZ NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS admission_lease ("
+    " key TEXT NOT NULL, slot INTEGER NOT NULL, holder TEXT NOT NULL, expires_at TIMESTAMPTZ NOT NULL,"
+    " PRIMARY KEY (key, slot))",
+]
+
+
+def run_migrations():
+    '''
+    Applies the idempotent schema migrations. Must be called inside an app context, after db.create_all().
+    '''
+    with db.engine.begin() as connection:
+        for statement in MIGRATIONS:
+            connection.execute(text(statement))
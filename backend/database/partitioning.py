@@ -0,0 +1,216 @@
+'''
+Tenant-partitioned layout for langchain_pg_embedding.
+
+The table is LIST partitioned by collection_id, with one partition (and one HNSW index) per tenant collection and a
+DEFAULT partition for anything else. Queries already filter on a literal collection_id, so Postgres prunes them to the
+tenant's partition, and deleting a tenant is a partition drop.
+
+Run from the backend directory:
+    python -m database.partitioning migrate          # move existing collections into the partitioned layout
+    python -m database.partitioning status
+    python -m database.partitioning drop-tenant <collection_name>
+
+Running processes cache the layout. One that still sees the old table switches over when its next insert fails on the
+partitioned one (see TimedPGVector), so migrating does not require restarting the app.
+'''
+import os
+import sys
+import argparse
+import threading
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+LEGACY_TABLE = "langchain_pg_embedding_unpartitioned"
+DEFAULT_PARTITION = "langchain_pg_embedding_default"
+
+# Must match the embeddings model (OpenAI embeddings, as in database.database.Vector)
+EMBEDDING_DIMENSIONS = 1536
+
+_lock = threading.Lock()
+_partitioned = {}
+_ensured_partitions = set()
+
+
+def partition_name(collection_uuid):
+    return f"langchain_pg_embedding_p_{str(collection_uuid).replace('-', '')}"
+
+
+def is_partitioned(engine):
+    '''
+    Whether langchain_pg_embedding uses the partitioned layout. Checked once per engine, until forget_layout.
+    '''
+    key = str(engine.url)
+    if key not in _partitioned:
+        with engine.connect() as connection:
+            relkind = connection.execute(text(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": EMBEDDING_TABLE}).scalar()
+        with _lock:
+            _partitioned[key] = relkind == 'p'
+    return _partitioned[key]
+
+
+def forget_layout(engine):
+    with _lock:
+        _partitioned.pop(str(engine.url), None)
+
+
+def is_layout_conflict(error):
+    '''
+    Whether a DBAPI error is the upstream ON CONFLICT (id) insert hitting the partitioned table, which has no unique
+    index on id alone (SQLSTATE 42P10).
+    '''
+    orig = getattr(error, "orig", error)
+    return (getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)) == "42P10"
+
+
+def create_partitioned_table(connection, table_name):
+    connection.execute(text(f'''
+        CREATE TABLE {table_name} (
+            id VARCHAR NOT NULL,
+            collection_id UUID NOT NULL REFERENCES {COLLECTION_TABLE} (uuid) ON DELETE CASCADE,
+            embedding VECTOR({EMBEDDING_DIMENSIONS}),
+            document VARCHAR,
+            cmetadata JSONB,
+            PRIMARY KEY (collection_id, id)
+        ) PARTITION BY LIST (collection_id)
+    '''))
+    connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {table_name} DEFAULT"))
+
+
+def create_partition_indexes(connection, collection_uuid):
+    name = partition_name(collection_uuid)
+    connection.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {name}_embedding_hnsw ON {name} USING hnsw (embedding vector_cosine_ops)"))
+
+
+def create_tenant_partition(connection, collection_uuid, table_name=EMBEDDING_TABLE, with_indexes=True):
+    name = partition_name(collection_uuid)
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} FOR VALUES IN ('{collection_uuid}')"))
+    if with_indexes:
+        create_partition_indexes(connection, collection_uuid)
+
+
+def ensure_tenant_partition(engine, collection_uuid):
+    '''
+    Creates the collection's partition if needed, before its first rows land in the DEFAULT partition.
+    Cached per process, so only the first call per collection touches the catalog.
+    '''
+    if collection_uuid in _ensured_partitions or not is_partitioned(engine):
+        return
+
+    with engine.begin() as connection:
+        # Concurrent IF NOT EXISTS DDL on the same name can still fail with a duplicate error, so serialize it
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": partition_name(collection_uuid)})
+        create_tenant_partition(connection, collection_uuid)
+
+    with _lock:
+        _ensured_partitions.add(collection_uuid)
+
+
+def drop_tenant(engine, collection_name):
+    '''
+    Deletes a tenant's collection by dropping its partition, instead of deleting its rows one by one.
+    '''
+    with engine.begin() as connection:
+        collection_uuid = connection.execute(text(
+            f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name"), {"name": collection_name}).scalar()
+        if collection_uuid is None:
+            raise ValueError(f"Collection {collection_name} not found")
+
+        connection.execute(text(f"DROP TABLE IF EXISTS {partition_name(collection_uuid)}"))
+        connection.execute(text(f"DELETE FROM {COLLECTION_TABLE} WHERE uuid = :uuid"), {"uuid": collection_uuid})
+
+    with _lock:
+        _ensured_partitions.discard(collection_uuid)
+
+
+def migrate(engine):
+    '''
+    Moves the existing langchain_pg_embedding table into the partitioned layout, one collection at a time.
+
+    Runs in a single transaction holding an exclusive lock on the old table, so writers wait rather than lose rows.
+    The old table is kept as langchain_pg_embedding_unpartitioned and can be dropped once the migration is verified.
+    '''
+    if is_partitioned(engine):
+        print("langchain_pg_embedding is already partitioned")
+        return
+
+    new_table = f"{EMBEDDING_TABLE}_partitioned"
+
+    with engine.begin() as connection:
+        connection.execute(text(f"LOCK TABLE {EMBEDDING_TABLE} IN EXCLUSIVE MODE"))
+        create_partitioned_table(connection, new_table)
+
+        collections = connection.execute(text(f"SELECT uuid, name FROM {COLLECTION_TABLE}")).all()
+        for collection_uuid, name in collections:
+            # Indexes are built after the copy, which is much faster than maintaining them row by row
+            create_tenant_partition(connection, collection_uuid, table_name=new_table, with_indexes=False)
+            moved = connection.execute(text(f'''
+                INSERT INTO {new_table} (id, collection_id, embedding, document, cmetadata)
+                SELECT id, collection_id, embedding, document, cmetadata FROM {EMBEDDING_TABLE}
+                WHERE collection_id = :uuid
+            '''), {"uuid": collection_uuid}).rowcount
+            create_partition_indexes(connection, collection_uuid)
+            print(f"Moved {moved} embeddings of collection {name}")
+
+        connection.execute(text(f"ALTER TABLE {EMBEDDING_TABLE} RENAME TO {LEGACY_TABLE}"))
+        connection.execute(text(f"ALTER TABLE {new_table} RENAME TO {EMBEDDING_TABLE}"))
+
+        # Deletes by id (PGVector.delete) and metadata filters across partitions
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_partitioned_embedding_id ON {EMBEDDING_TABLE} (id)"))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_partitioned_cmetadata_gin ON {EMBEDDING_TABLE} USING gin (cmetadata jsonb_path_ops)"))
+
+    with _lock:
+        _partitioned[str(engine.url)] = True
+    print(f"Migrated {len(collections)} collections, the old table was kept as {LEGACY_TABLE}")
+
+
+def status(engine):
+    if not is_partitioned(engine):
+        print("langchain_pg_embedding is not partitioned, run: python -m database.partitioning migrate")
+        return
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(f'''
+            SELECT c.name, p.relname, pg_total_relation_size(p.oid)
+            FROM pg_inherits i
+            JOIN pg_class p ON p.oid = i.inhrelid
+            LEFT JOIN {COLLECTION_TABLE} c ON p.relname = 'langchain_pg_embedding_p_' || replace(c.uuid::text, '-', '')
+            WHERE i.inhparent = to_regclass(:table)
+            ORDER BY 3 DESC
+        '''), {"table": EMBEDDING_TABLE}).all()
+
+    for name, partition, size in rows:
+        print(f"{partition:<60} {size / 1e6:10.1f} MB  {name or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the tenant-partitioned embeddings table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate")
+    subparsers.add_parser("status")
+    drop_parser = subparsers.add_parser("drop-tenant")
+    drop_parser.add_argument("collection_name")
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(os.getenv("DATABASE_URI"))
+
+    if args.command == "migrate":
+        migrate(engine)
+    elif args.command == "status":
+        status(engine)
+    else:
+        drop_tenant(engine, args.collection_name)
+        print(f"Dropped collection {args.collection_name}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
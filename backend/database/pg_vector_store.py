@@ -1,16 +1,269 @@
+import os
+import uuid
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError, ProgrammingError
+from sqlalchemy.dialects.postgresql import insert
 from langchain_postgres import PGVector
+from langchain_postgres.vectorstores import Base, DistanceStrategy, _create_vector_extension, _get_embedding_collection_store
+from langchain_postgres._utils import maximal_marginal_relevance
+
+from metrics.metrics import timed
+from database.partitioning import is_partitioned, ensure_tenant_partition, forget_layout, is_layout_conflict
+from database.hot_index import hot_index
+
+# Store instances kept per process, so /search and /upload reuse them (and their engine) instead of rebuilding them
+VECTOR_STORE_CACHE_SIZE = int(os.getenv('VECTOR_STORE_CACHE_SIZE', 256))
+
+_lock = threading.Lock()
+_engines = {}
+_stores = OrderedDict()
+
+# (database url, collection name) -> collection uuid, filled on first use of each collection
+_collection_ids = {}
+
+# Stands in for the CollectionStore row: PGVector only reads the uuid of the collection it gets
+CachedCollection = namedtuple("CachedCollection", ["uuid", "name"])
+
+
+def get_engine(connection_uri):
+    with _lock:
+        engine = _engines.get(connection_uri)
+        if engine is None:
+            engine = _engines[connection_uri] = create_engine(connection_uri, pool_pre_ping=True)
+    return engine
+
+
+def init_vector_schema(connection_uri):
+    '''
+    Creates the vector extension and the langchain_pg_collection / langchain_pg_embedding tables if needed.
+
+    PGVector does this in its constructor; TimedPGVector skips it, so this must run once at startup (see app.py).
+    '''
+    engine = get_engine(connection_uri)
+    with engine.connect() as connection:
+        _create_vector_extension(connection)
+
+    _get_embedding_collection_store()
+    Base.metadata.create_all(engine)
+
+
+def forget_collection(engine, collection_name):
+    with _lock:
+        _collection_ids.pop((str(engine.url), str(collection_name)), None)
+
+
+class TimedPGVector(PGVector):
+    '''
+    PGVector store that records the pgvector query, the MMR re-ranking and inserts as separate /search and /upload stages.
+
+    Also supports the tenant-partitioned layout of database/partitioning.py: collections get their own partition when
+    created, and upserts conflict on (collection_id, id) since a partitioned table cannot have a unique index on id alone.
+
+    Unlike PGVector, building a store runs no DDL and no collection upsert: the schema is created once by
+    init_vector_schema, the collection on its first write, and collection ids are cached per process. Searching a
+    collection that does not exist yet returns no results.
+
+    Queries of hot collections are served from the in-process index of database/hot_index.py when it is enabled,
+    and writes and deletes made through the store are applied to it.
+    '''
+
+    def __post_init__(self):
+        self.EmbeddingStore, self.CollectionStore = _get_embedding_collection_store(self._embedding_length)
+
+    def _collection_key(self):
+        return (str(self._engine.url), self.collection_name)
+
+    def get_collection(self, session):
+        key = self._collection_key()
+        collection_uuid = _collection_ids.get(key)
+
+        if collection_uuid is None:
+            collection = self.CollectionStore.get_by_name(session, self.collection_name)
+            if collection is None:
+                return None
+            collection_uuid = collection.uuid
+            with _lock:
+                _collection_ids[key] = collection_uuid
+
+        return CachedCollection(collection_uuid, self.collection_name)
+
+    def create_collection(self):
+        # Concurrent first uploads of a new user race to create the collection: the insert is a no-op for the loser
+        if self.pre_delete_collection:
+            self.delete_collection()
+        with self._make_sync_session() as session:
+            session.execute(
+                insert(self.CollectionStore)
+                .values(uuid=uuid.uuid4(), name=self.collection_name, cmetadata=self.collection_metadata)
+                .on_conflict_do_nothing(index_elements=["name"])
+            )
+            session.commit()
+
+        with self._make_sync_session() as session:
+            collection = self.get_collection(session)
+        if is_partitioned(self._engine):
+            ensure_tenant_partition(self._engine, collection.uuid)
+
+    def ensure_collection(self):
+        with self._make_sync_session() as session:
+            collection = self.get_collection(session)
+        if collection is None:
+            self.create_collection()
+
+    def delete_collection(self):
+        forget_collection(self._engine, self.collection_name)
+        hot_index.invalidate(self._collection_key())
+        with self._make_sync_session() as session:
+            collection = self.CollectionStore.get_by_name(session, self.collection_name)
+            if collection is not None:
+                session.delete(collection)
+                session.commit()
+
+    def _PGVector__query_collection(self, embedding, k=4, filter=None):
+        with self._make_sync_session() as session:
+            if self.get_collection(session) is None:
+                return []
+        return super()._PGVector__query_collection(embedding=embedding, k=k, filter=filter)
+
+    def delete(self, ids=None, collection_only=False, **kwargs):
+        super().delete(ids=ids, collection_only=collection_only, **kwargs)
+        if ids:
+            hot_index.remove(str(self._engine.url), ids)
+
+    def _hot_index(self, filter):
+        # Metadata filters and other distance strategies are left to pgvector
+        if not hot_index.enabled or filter or self._distance_strategy != DistanceStrategy.COSINE:
+            return None
+        return hot_index.lookup(self._collection_key(), self)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        index = self._hot_index(filter)
+        if index is None:
+            with timed("vector_query"):
+                return super().similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+        with timed("hot_index_query"):
+            return [(doc, distance) for doc, distance, _ in index.search(embedding, k)]
+
+    def max_marginal_relevance_search_with_score_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        index = self._hot_index(filter)
+        if index is not None:
+            with timed("hot_index_query"):
+                results = index.search(embedding, fetch_k)
+
+            with timed("mmr"):
+                mmr_selected = maximal_marginal_relevance(
+                    np.array(embedding, dtype=np.float32),
+                    [vector for _, _, vector in results],
+                    k=k,
+                    lambda_mult=lambda_mult,
+                )
+
+            return [(doc, distance) for i, (doc, distance, _) in enumerate(results) if i in mmr_selected]
+
+        with timed("vector_query"):
+            results = self._PGVector__query_collection(embedding=embedding, k=fetch_k, filter=filter)
+
+        with timed("mmr"):
+            embedding_list = [result.EmbeddingStore.embedding for result in results]
+
+            mmr_selected = maximal_marginal_relevance(
+                np.array(embedding, dtype=np.float32),
+                embedding_list,
+                k=k,
+                lambda_mult=lambda_mult,
+            )
+
+            candidates = self._results_to_docs_and_scores(results)
+
+        return [r for i, r in enumerate(candidates) if i in mmr_selected]
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None, **kwargs):
+        with timed("vector_insert"):
+            self.ensure_collection()
+            try:
+                ids = self._add_embeddings(texts, embeddings, metadatas, ids, **kwargs)
+            except IntegrityError:
+                # The cached collection was deleted by another process: recreate it and retry once
+                forget_collection(self._engine, self.collection_name)
+                self.ensure_collection()
+                ids = self._add_embeddings(texts, embeddings, metadatas, ids, **kwargs)
+
+        # Write-through, a no-op unless the collection is loaded in the hot index
+        hot_index.upsert(self._collection_key(), ids, list(texts), metadatas or [{} for _ in ids], embeddings)
+        return ids
+
+    def _add_embeddings(self, texts, embeddings, metadatas, ids, **kwargs):
+        if not is_partitioned(self._engine):
+            try:
+                return super().add_embeddings(texts, embeddings, metadatas=metadatas, ids=ids, **kwargs)
+            except ProgrammingError as e:
+                # The table was migrated to the partitioned layout after this process checked it
+                if not is_layout_conflict(e):
+                    raise
+                forget_layout(self._engine)
+                if not is_partitioned(self._engine):
+                    raise
+                with self._make_sync_session() as session:
+                    ensure_tenant_partition(self._engine, self.get_collection(session).uuid)
+        return self._add_embeddings_partitioned(texts, embeddings, metadatas, ids)
+
+    def _add_embeddings_partitioned(self, texts, embeddings, metadatas, ids):
+        ids_ = [id if id is not None else str(uuid.uuid4()) for id in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+
+        with self._make_sync_session() as session:
+            collection = self.get_collection(session)
+            if not collection:
+                raise ValueError("Collection not found")
+
+            data = [
+                {"id": id, "collection_id": collection.uuid, "embedding": embedding, "document": text, "cmetadata": metadata or {}}
+                for text, metadata, embedding, id in zip(texts, metadatas, embeddings, ids_)
+            ]
+            stmt = insert(self.EmbeddingStore).values(data)
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=["collection_id", "id"],
+                set_={
+                    "embedding": stmt.excluded.embedding,
+                    "document": stmt.excluded.document,
+                    "cmetadata": stmt.excluded.cmetadata,
+                },
+            ))
+            session.commit()
+
+        return ids_
+
 
 def build_pg_vector_store(embeddings_model, collection_name, connection_uri):
     '''
     Builds and returns an instance of a PGVector store given an embeddings model, db collection name and db connection url.
 
     Built instance can be used for semantic search and retrieval functionality
+
+    Instances are cached per process and share one engine per connection url, so this is cheap on the request path.
     '''
-    vector_store = PGVector(
+    key = (id(embeddings_model), str(collection_name), connection_uri)
+
+    with _lock:
+        vector_store = _stores.get(key)
+        if vector_store is not None:
+            _stores.move_to_end(key)
+            return vector_store
+
+    vector_store = TimedPGVector(
         embeddings=embeddings_model,
-        collection_name=collection_name,
-        connection=connection_uri,
+        collection_name=str(collection_name),
+        connection=get_engine(connection_uri),
         use_jsonb=True,
     )
 
-    return vector_store
\ No newline at end of file
+    with _lock:
+        vector_store = _stores.setdefault(key, vector_store)
+        while len(_stores) > VECTOR_STORE_CACHE_SIZE:
+            _stores.popitem(last=False)
+
+    return vector_store
@@ -0,0 +1,321 @@
+'''
+Binary snapshots of a tenant's vector collection.
+
+Moves a collection (chunks, metadata and embeddings) between databases without re-running OCR, transcription or the
+embeddings API. Run from the backend directory:
+    python -m database.snapshots export <collection_name> <snapshot_path> [--batch-size 1000]
+    python -m database.snapshots import <snapshot_path> [--collection <new_name>] [--replace]
+    python -m database.snapshots verify <snapshot_path>
+
+A snapshot path ending in .gz is gzip compressed, and "-" streams through stdout/stdin, so a collection can be copied
+straight between databases:
+    python -m database.snapshots export <name> - | python -m database.snapshots import - --database-uri <target_uri>
+
+The file is a sequence of frames (1 byte kind, 8 byte length, payload): a JSON header, then per batch a JSON frame with
+the ids, documents and metadata followed by a .npy frame with the (rows, dimensions) float32 vectors, and a JSON footer
+with the row count and the sha256 of every frame before it. Both directions hold one batch in memory at a time.
+Only the vector collection is copied: File rows and stored blobs are not part of a snapshot.
+'''
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import uuid
+import struct
+import hashlib
+import argparse
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from database.partitioning import (
+    EMBEDDING_TABLE, COLLECTION_TABLE, EMBEDDING_DIMENSIONS, is_partitioned, partition_name, create_tenant_partition,
+    create_partition_indexes)
+
+SNAPSHOT_VERSION = 1
+MAGIC = b"TWSNAP1\n"
+
+HEADER, BATCH, VECTORS, FOOTER = b"H", b"B", b"V", b"E"
+_FRAME = struct.Struct(">cQ")
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def open_snapshot(path, mode):
+    if path == "-":
+        return sys.stdout.buffer if mode == "wb" else sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class SnapshotWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.rows = 0
+        f.write(MAGIC)
+
+    def _frame(self, kind, payload, checksummed=True):
+        frame = _FRAME.pack(kind, len(payload)) + payload
+        if checksummed:
+            self.sha256.update(frame)
+        self.f.write(frame)
+
+    def write_header(self, header):
+        self._frame(HEADER, json.dumps(header).encode())
+
+    def write_batch(self, ids, documents, metadatas, vectors):
+        self._frame(BATCH, json.dumps({"ids": ids, "documents": documents, "metadatas": metadatas}).encode())
+
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(vectors, dtype=np.float32), allow_pickle=False)
+        self._frame(VECTORS, buffer.getvalue())
+        self.rows += len(ids)
+
+    def close(self):
+        self._frame(FOOTER, json.dumps({"rows": self.rows, "sha256": self.sha256.hexdigest()}).encode(), checksummed=False)
+        self.f.flush()
+
+
+def read_snapshot(f):
+    '''
+    Yields ("header", dict), then ("batch", (ids, documents, metadatas, vectors)) per batch.
+
+    The footer is checked last, so consumers must treat everything read as unverified until the generator is exhausted:
+    it raises SnapshotError on a truncated or corrupted snapshot.
+    '''
+    if f.read(len(MAGIC)) != MAGIC:
+        raise SnapshotError("Not a snapshot file")
+
+    sha256 = hashlib.sha256()
+    rows = 0
+    batch = None
+
+    while True:
+        prefix = f.read(_FRAME.size)
+        if len(prefix) < _FRAME.size:
+            raise SnapshotError("Truncated snapshot: missing footer")
+        kind, length = _FRAME.unpack(prefix)
+        payload = f.read(length)
+        if len(payload) < length:
+            raise SnapshotError("Truncated snapshot")
+
+        if kind == FOOTER:
+            footer = json.loads(payload)
+            if footer["sha256"] != sha256.hexdigest() or footer["rows"] != rows:
+                raise SnapshotError("Snapshot checksum mismatch")
+            return
+
+        sha256.update(prefix + payload)
+
+        try:
+            if kind == HEADER:
+                yield "header", json.loads(payload)
+            elif kind == BATCH:
+                batch = json.loads(payload)
+            elif kind == VECTORS:
+                if batch is None:
+                    raise SnapshotError("Vectors frame without a batch frame")
+                vectors = np.load(io.BytesIO(payload), allow_pickle=False)
+                if len(vectors) != len(batch["ids"]):
+                    raise SnapshotError("Batch and vectors row counts differ")
+                rows += len(vectors)
+                yield "batch", (batch["ids"], batch["documents"], batch["metadatas"], vectors)
+                batch = None
+            else:
+                raise SnapshotError(f"Unknown frame kind {kind!r}")
+        except ValueError as e:
+            raise SnapshotError(f"Corrupted snapshot: {e}") from e
+
+
+def export_collection(engine, collection_name, f, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Streams a collection into a snapshot, reading batch_size rows at a time through a server-side cursor.
+    '''
+    writer = SnapshotWriter(f)
+
+    with engine.connect() as connection:
+        collection = connection.execute(text(
+            f"SELECT uuid, cmetadata FROM {COLLECTION_TABLE} WHERE name = :name"), {"name": collection_name}).first()
+        if collection is None:
+            raise SnapshotError(f"Collection {collection_name} not found")
+
+        writer.write_header({
+            "version": SNAPSHOT_VERSION,
+            "collection": collection_name,
+            "cmetadata": collection.cmetadata,
+            "dimensions": EMBEDDING_DIMENSIONS,
+            "dtype": "float32",
+        })
+
+        result = connection.execution_options(stream_results=True, max_row_buffer=batch_size).execute(text(f'''
+            SELECT id, document, cmetadata, embedding::real[] AS embedding FROM {EMBEDDING_TABLE}
+            WHERE collection_id = :uuid ORDER BY id
+        '''), {"uuid": collection.uuid})
+
+        for rows in result.partitions(batch_size):
+            writer.write_batch(
+                [row.id for row in rows],
+                [row.document for row in rows],
+                [row.cmetadata for row in rows],
+                np.array([row.embedding for row in rows], dtype=np.float32).reshape(len(rows), -1),
+            )
+
+    writer.close()
+    return writer.rows
+
+
+def _vector_literal(vector):
+    # %.9g round-trips float32 exactly
+    return "[" + ",".join(map("{:.9g}".format, vector.tolist())) + "]"
+
+
+def _copy_batch(dbapi_connection, collection_uuid, ids, documents, metadatas, vectors):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for id, document, metadata, vector in zip(ids, documents, metadatas, vectors):
+        writer.writerow([id, collection_uuid, _vector_literal(vector), document, json.dumps(metadata)])
+    buffer.seek(0)
+
+    statement = (f"COPY {EMBEDDING_TABLE} (id, collection_id, embedding, document, cmetadata) "
+                 "FROM STDIN WITH (FORMAT csv)")
+    cursor = dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            # psycopg2
+            cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
+
+
+def _prepare_collection(connection, collection_name, cmetadata, replace):
+    collection_uuid = connection.execute(text(
+        f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name"), {"name": collection_name}).scalar()
+
+    if collection_uuid is None:
+        collection_uuid = str(uuid.uuid4())
+        connection.execute(text(
+            f"INSERT INTO {COLLECTION_TABLE} (uuid, name, cmetadata) VALUES (:uuid, :name, CAST(:cmetadata AS json))"),
+            {"uuid": collection_uuid, "name": collection_name, "cmetadata": json.dumps(cmetadata)})
+        return collection_uuid
+
+    existing = connection.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {EMBEDDING_TABLE} WHERE collection_id = :uuid)"), {"uuid": collection_uuid}).scalar()
+    if existing:
+        if not replace:
+            raise SnapshotError(f"Collection {collection_name} already has embeddings, use --replace to overwrite them")
+        connection.execute(text(f"DELETE FROM {EMBEDDING_TABLE} WHERE collection_id = :uuid"), {"uuid": collection_uuid})
+    return str(collection_uuid)
+
+
+def import_collection(engine, f, collection_name=None, replace=False):
+    '''
+    Bulk-loads a snapshot with COPY, one batch at a time, in a single transaction.
+
+    In the partitioned layout the tenant partition's HNSW index is dropped during the load and rebuilt afterwards.
+    The transaction only commits once the snapshot's checksum has been verified.
+    Returns the (collection_name, rows) imported.
+    '''
+    rows = 0
+    partitioned = is_partitioned(engine)
+
+    with engine.begin() as connection:
+        dbapi_connection = connection.connection.dbapi_connection
+        collection_uuid = None
+
+        for kind, value in read_snapshot(f):
+            if kind == "header":
+                if value.get("version") != SNAPSHOT_VERSION:
+                    raise SnapshotError(f"Unsupported snapshot version {value.get('version')}")
+                if value.get("dimensions") != EMBEDDING_DIMENSIONS:
+                    raise SnapshotError(f"Snapshot has {value.get('dimensions')} dimensional vectors, "
+                                        f"expected {EMBEDDING_DIMENSIONS}")
+
+                collection_name = collection_name or value["collection"]
+                collection_uuid = _prepare_collection(connection, collection_name, value.get("cmetadata"), replace)
+
+                if partitioned:
+                    create_tenant_partition(connection, collection_uuid, with_indexes=False)
+                    connection.execute(text(f"DROP INDEX IF EXISTS {partition_name(collection_uuid)}_embedding_hnsw"))
+            else:
+                if collection_uuid is None:
+                    raise SnapshotError("Snapshot has no header")
+                _copy_batch(dbapi_connection, collection_uuid, *value)
+                rows += len(value[0])
+                print(f"Imported {rows} rows", file=sys.stderr)
+
+        if partitioned:
+            create_partition_indexes(connection, collection_uuid)
+        connection.execute(text(f"ANALYZE {EMBEDDING_TABLE}"))
+
+    return collection_name, rows
+
+
+def verify_snapshot(f):
+    header, rows = None, 0
+    for kind, value in read_snapshot(f):
+        if kind == "header":
+            header = value
+        else:
+            rows += len(value[0])
+    return header, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and import binary snapshots of vector collections.")
+    parser.add_argument("--database-uri", default=None, help="defaults to DATABASE_URI")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("collection_name")
+    export_parser.add_argument("snapshot_path")
+    export_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("snapshot_path")
+    import_parser.add_argument("--collection", default=None, help="import under another collection name")
+    import_parser.add_argument("--replace", action="store_true", help="overwrite the collection's existing embeddings")
+
+    verify_parser = subparsers.add_parser("verify")
+    verify_parser.add_argument("snapshot_path")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "verify":
+            with open_snapshot(args.snapshot_path, "rb") as f:
+                header, rows = verify_snapshot(f)
+            print(f"Snapshot of collection {header['collection']} is valid: {rows} rows")
+            return 0
+
+        load_dotenv()
+        engine = create_engine(args.database_uri or os.getenv("DATABASE_URI"))
+
+        if args.command == "export":
+            with open_snapshot(args.snapshot_path, "wb") as f:
+                rows = export_collection(engine, args.collection_name, f, args.batch_size)
+            print(f"Exported {rows} rows of collection {args.collection_name}", file=sys.stderr)
+        else:
+            with open_snapshot(args.snapshot_path, "rb") as f:
+                collection_name, rows = import_collection(engine, f, args.collection, args.replace)
+            print(f"Imported {rows} rows into collection {collection_name}", file=sys.stderr)
+    except SnapshotError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
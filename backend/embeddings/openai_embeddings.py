@@ -1,4 +1,28 @@
 from langchain.embeddings import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from metrics.metrics import timed
+from admission.admission_control import embedding_calls
+
+
+class TimedEmbeddings(Embeddings):
+    '''
+    Wraps an embeddings model and records query and document embedding latency as /search and /upload stages.
+
+    Calls go through the global cap on in-flight embedding calls.
+    '''
+
+    def __init__(self, embeddings_model):
+        self.embeddings_model = embeddings_model
+
+    def embed_documents(self, texts):
+        with embedding_calls.admit("global"), timed("embed_documents"):
+            return self.embeddings_model.embed_documents(texts)
+
+    def embed_query(self, text):
+        with embedding_calls.admit("global"), timed("embed_query"):
+            return self.embeddings_model.embed_query(text)
+
 
 # Using OpenAI embeddings for now
-openai_embeddings = OpenAIEmbeddings()
\ No newline at end of file
+openai_embeddings = TimedEmbeddings(OpenAIEmbeddings())
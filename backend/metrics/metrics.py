@@ -0,0 +1,218 @@
+import time
+import bisect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency buckets in seconds, spanning fast DB lookups up to slow OCR/transcription stages
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def mean(self, **labels):
+        state = self._values.get(self._key(labels))
+        if not state or not state[2]:
+            return 0.0
+        return state[1] / state[2]
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, extra=[("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    '''
+    Holds the process' metrics and renders them in the Prometheus text exposition format.
+
+    Values live in process memory, so with several workers each one reports its own series (scrape each worker
+    or aggregate them in Prometheus).
+    '''
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram(
+    "trainingwheels_request_duration_seconds", "Wall time of instrumented endpoints.", ("endpoint",)))
+stage_seconds = registry.register(Histogram(
+    "trainingwheels_stage_duration_seconds", "Wall time of each stage of /search and /upload.", ("stage",)))
+errors = registry.register(Counter(
+    "trainingwheels_errors_total", "Exceptions raised by instrumented endpoints and stages.", ("where",)))
+cache_events = registry.register(Counter(
+    "trainingwheels_cache_events_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result")))
+llm_calls_saved = registry.register(Counter(
+    "trainingwheels_llm_calls_saved_total", "LLM calls skipped by a fast path, by stage and reason.", ("stage", "reason")))
+llm_seconds_saved = registry.register(Counter(
+    "trainingwheels_llm_seconds_saved_total",
+    "Estimated LLM seconds saved by fast paths (skipped calls times the stage's mean latency).", ("stage",)))
+
+
+# Set by the request profiler to collect the stage timings of a single profiled request
+stage_recorder = ContextVar("stage_recorder", default=None)
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+
+    recorder = stage_recorder.get()
+    if recorder is not None:
+        recorder.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    '''
+    Records the wall time of the wrapped block in the stage histogram, counting an error if it raises.
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        errors.inc(where=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def record_cache(cache, hit):
+    cache_events.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_llm_call_saved(stage, reason):
+    llm_calls_saved.inc(stage=stage, reason=reason)
+    llm_seconds_saved.inc(stage_seconds.mean(stage=stage), stage=stage)
+
+
+def instrument_route(endpoint):
+    '''
+    Decorator for Flask view functions recording the request wall time and counting 5xx responses and exceptions as errors.
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                errors.inc(where=endpoint)
+                raise
+            finally:
+                request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+
+            status = response[1] if isinstance(response, tuple) and len(response) > 1 else getattr(response, "status_code", 200)
+            if isinstance(status, int) and status >= 500:
+                errors.inc(where=endpoint)
+            return response
+        return wrapper
+    return decorator
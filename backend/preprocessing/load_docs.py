@@ -1,14 +1,86 @@
+'''
+Bulk loader for the knowledge base.
+
+Run from the backend directory:
+    python -m preprocessing.load_docs ./knowledge_base --collection <collection_name> [--workers 8]
+
+Files are embedded by a pool of worker threads (the work is dominated by the embeddings API and database round-trips).
+A checkpoint manifest records the size, mtime and hash of every file that was loaded, so an interrupted or repeated run
+only processes new or changed files.
+'''
 import os
+import sys
 import glob
-from datetime import datetime
+import time
+import uuid
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.document_loaders import TextLoader
-from langchain_postgres import PGVector
-from langchain_postgres.vectorstores import PGVector
 from langchain.embeddings import OpenAIEmbeddings
 
-def load_docs(embeddings_model, documents_path, collection_name, database_uri):
+from preprocessing.manifest import Manifest
+from database.pg_vector_store import build_pg_vector_store, init_vector_schema
+
+# How many completed files between manifest checkpoints
+CHECKPOINT_EVERY = 10
+
+
+def chunk_ids(collection_name, file_path, sha256, count):
+    '''
+    Deterministic chunk ids for a given version of a file.
+
+    Re-adding the same file version after a crash upserts the same rows instead of duplicating them.
+    '''
+    prefix = f"{collection_name}:{os.path.abspath(file_path)}:{sha256}"
+    return [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{prefix}:{i}")) for i in range(count)]
+
+
+def load_file(vector_store, text_splitter, manifest, collection_name, file_path):
+    '''
+    Loads a single file into the vector store if it is new or has changed since the last run.
+
+    Returns a (status, fingerprint, ids) tuple where status is one of "loaded", "skipped" or "unchanged".
+    "unchanged" means the content is the same but the mtime moved, so the manifest entry should be refreshed.
+    '''
+    fingerprint, changed = manifest.check(file_path)
+    entry = manifest.get(file_path)
+
+    if not changed:
+        status = "skipped" if entry['mtime'] == fingerprint['mtime'] else "unchanged"
+        return status, fingerprint, entry['ids']
+
+    # Load and split the document
+    loader = TextLoader(file_path)
+    docs = loader.load_and_split(text_splitter=text_splitter)
+    ids = chunk_ids(collection_name, file_path, fingerprint['sha256'], len(docs))
+
+    # Add documents to the vector store
+    if docs:
+        vector_store.add_documents(docs, ids=ids)
+
+    # Remove the chunks of the previous version of this file
+    if entry and entry['ids']:
+        stale_ids = list(set(entry['ids']) - set(ids))
+        if stale_ids:
+            vector_store.delete(ids=stale_ids)
+
+    return "loaded", fingerprint, ids
+
+
+def print_progress(done, total, chunks, started):
+    elapsed = max(time.monotonic() - started, 1e-9)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate > 0 else 0.0
+
+    sys.stderr.write(
+        f"\r{done}/{total} files | {rate:.1f} files/s | {chunks / elapsed:.1f} chunks/s | ETA {eta:.0f}s ")
+    sys.stderr.flush()
+
+
+def load_docs(embeddings_model, documents_path, collection_name, database_uri, manifest_path=None, workers=4):
     '''
     Loads vectorized knowledge base embeddings into vector database (PGVector).
 
@@ -17,41 +89,94 @@ def load_docs(embeddings_model, documents_path, collection_name, database_uri):
     Chunk size is currently set to 200 with an overlap of 0. This may have to be adjusted in the future.
 
     Note: This function calls OpenAIEmbeddings() which costs money to run and can be fairly expensive so try to limit this operation.
-          Ideally, the vector database should only need to be loaded initially and whenever we have new data
+          Only files that are not yet in the manifest (or whose contents changed) are embedded again.
+
+    Returns a summary dictionary with the number of loaded, skipped and failed files.
     '''
-    
+
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=200, chunk_overlap=0)
+        chunk_size=200, chunk_overlap=0, add_start_index=True)
+
+    file_paths = sorted(glob.glob(os.path.join(documents_path, '**', '*.txt'), recursive=True))
+
+    if manifest_path is None:
+        manifest_path = os.path.join(documents_path, f".load_docs-{collection_name}.json")
+    manifest = Manifest(manifest_path)
+
+    # TimedPGVector handles both the plain and the tenant-partitioned embeddings table
+    init_vector_schema(database_uri)
+    vector_store = build_pg_vector_store(
+        embeddings_model=embeddings_model, collection_name=collection_name, connection_uri=database_uri)
+
+    summary = {"total": len(file_paths), "loaded": 0, "skipped": 0, "failed": 0, "chunks": 0, "errors": {}}
+    started = time.monotonic()
+
+    # Process the files in parallel, checkpointing the manifest from this thread only
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(load_file, vector_store, text_splitter, manifest, collection_name, file_path): file_path
+            for file_path in file_paths
+        }
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_path = futures[future]
+            try:
+                status, fingerprint, ids = future.result()
+
+                if status == "loaded":
+                    summary["loaded"] += 1
+                    summary["chunks"] += len(ids)
+                else:
+                    summary["skipped"] += 1
+
+                if status != "skipped":
+                    manifest.record(file_path, fingerprint, ids=ids)
+            except Exception as e:
+                summary["failed"] += 1
+                summary["errors"][file_path] = str(e)
+
+            if done % CHECKPOINT_EVERY == 0:
+                manifest.save()
+            print_progress(done, len(file_paths), summary["chunks"], started)
+
+    manifest.save()
+    summary["elapsed"] = time.monotonic() - started
+    sys.stderr.write("\n")
+
+    return summary
+
+
+def print_summary(summary):
+    print(f"Loaded {summary['loaded']} files ({summary['chunks']} chunks), skipped {summary['skipped']} unchanged files, "
+          f"{summary['failed']} failed, out of {summary['total']} in {summary['elapsed']:.1f}s")
+
+    for file_path, error in summary["errors"].items():
+        print(f"Error processing {file_path}: {error}")
 
-    file_paths = glob.glob(os.path.join(documents_path, '**', '*.txt'), recursive=True)
 
-    vector_store = PGVector(
-        embeddings=embeddings_model,
-        collection_name=collection_name,
-        connection=database_uri,
-        use_jsonb=True,
-    )
+def main():
+    parser = argparse.ArgumentParser(description="Load a knowledge base of .txt files into a PGVector collection.")
+    parser.add_argument("documents_path", nargs="?", default="./knowledge_base/")
+    parser.add_argument("--collection", required=True, help="name of the PGVector collection to load into")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--manifest", default=None,
+                        help="checkpoint manifest path (default: <documents_path>/.load_docs-<collection>.json)")
+    args = parser.parse_args()
 
-    # Process each file
-    for file_path in file_paths:
-        try:
-            # Load and split the document
-            loader = TextLoader(file_path)
-            docs = loader.load_and_split(text_splitter=text_splitter)
+    load_dotenv()
+    database_uri = os.getenv("POSTGRESQL_CONNECTION_STRING")
 
-            # Add documents to the vector store
-            vector_store.add_documents(docs)
+    # Using OpenAI embeddings for now
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    embeddings_model = OpenAIEmbeddings(openai_api_key=openai_api_key)
 
-            print(f"Processed {file_path}")
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+    summary = load_docs(embeddings_model=embeddings_model, documents_path=args.documents_path,
+                        collection_name=args.collection, database_uri=database_uri,
+                        manifest_path=args.manifest, workers=args.workers)
+    print_summary(summary)
 
-docs_path = "./knowledge_base/"
-collection_name = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-database_uri = os.getenv("POSTGRESQL_CONNECTION_STRING")
+    return 1 if summary["failed"] else 0
 
-# Using OpenAI embeddings for now
-openai_api_key = os.getenv("OPENAI_API_KEY")
-embeddings_model = OpenAIEmbeddings(openai_api_key=openai_api_key)
 
-load_docs(embeddings_model=embeddings_model, documents_path=docs_path, collection_name=collection_name, database_uri=database_uri)
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    '''
+    Returns the sha256 hex digest of a file, reading it in fixed size blocks so large files are never fully loaded in memory.
+    '''
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def atomic_write(path, data, mode='w'):
+    '''
+    Writes data to path through a temporary file in the same directory followed by os.replace.
+
+    Readers (and a rerun after a crash) either see the previous file or the complete new one, never a partially written file.
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Manifest:
+    '''
+    Checkpoint manifest for the offline preprocessing scripts.
+
+    Maps each source file (by absolute path) to the size, mtime and sha256 it had when it was last processed, plus any
+    extra bookkeeping the caller wants to keep (e.g. the ids of the chunks written for it).
+    The size/mtime pair is checked first so unchanged files are skipped without being hashed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, file_path):
+        return self.entries.get(os.path.abspath(file_path))
+
+    def check(self, file_path):
+        '''
+        Returns a (fingerprint, changed) tuple for file_path.
+
+        changed is False when the file matches the manifest entry, either by size/mtime or, if those moved, by content hash.
+        '''
+        stat = os.stat(file_path)
+        entry = self.get(file_path)
+
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return {'size': entry['size'], 'mtime': entry['mtime'], 'sha256': entry['sha256']}, False
+
+        fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': file_digest(file_path)}
+        changed = entry is None or entry['sha256'] != fingerprint['sha256']
+        return fingerprint, changed
+
+    def record(self, file_path, fingerprint, **extra):
+        self.entries[os.path.abspath(file_path)] = {**fingerprint, **extra}
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.entries, indent=2, sort_keys=True))
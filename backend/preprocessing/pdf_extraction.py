@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pypdf import PdfReader
+from pdf2image import convert_from_path
+import pytesseract
+from langchain_core.documents import Document
+
+from metrics.metrics import registry, Counter, timed
+
+# Pages whose text layer has fewer alphanumeric characters than this are treated as scanned and OCRed
+PDF_MIN_TEXT_CHARS = int(os.getenv('PDF_MIN_TEXT_CHARS', 20))
+
+# Pages rasterized and OCRed at once (pdftoppm and tesseract run as subprocesses, so threads run them in parallel)
+PDF_OCR_WORKERS = int(os.getenv('PDF_OCR_WORKERS', os.cpu_count() or 2))
+PDF_OCR_DPI = int(os.getenv('PDF_OCR_DPI', 300))
+
+pdf_pages = registry.register(Counter(
+    "trainingwheels_pdf_pages_total", "PDF pages extracted, by method (text layer, OCR or empty).", ("method",)))
+
+
+def has_text_layer(text):
+    return sum(character.isalnum() for character in text) >= PDF_MIN_TEXT_CHARS
+
+
+def ocr_page(pdf_path, page_number):
+    '''
+    Rasterizes and OCRs a single page (page_number starts at 1, as for pdftoppm).
+    '''
+    images = convert_from_path(pdf_path, dpi=PDF_OCR_DPI, first_page=page_number, last_page=page_number)
+    return "\n".join(pytesseract.image_to_string(image) for image in images)
+
+
+def extract_pdf_pages(pdf_path, source=None, workers=PDF_OCR_WORKERS):
+    '''
+    Returns one Document per non-empty page of a PDF.
+
+    Each page's text layer is used when it has one, and only the pages without one (scans, images of text) are OCRed,
+    with up to workers threads. The metadata has the 0-based "page" (as PyPDFLoader), the source and the extraction method.
+    '''
+    source = source or pdf_path
+
+    with timed("pdf_text"):
+        reader = PdfReader(pdf_path)
+        texts = []
+        for page in reader.pages:
+            try:
+                texts.append(page.extract_text() or "")
+            except Exception as e:
+                print(f"Error extracting the text layer of a page of {source}: {e}")
+                texts.append("")
+
+    methods = ["text" if has_text_layer(text) else "ocr" for text in texts]
+    ocr_pages = [index for index, method in enumerate(methods) if method == "ocr"]
+
+    if ocr_pages:
+        with timed("ocr"), ThreadPoolExecutor(max_workers=max(1, min(workers, len(ocr_pages)))) as executor:
+            for index, text in zip(ocr_pages, executor.map(lambda index: ocr_page(pdf_path, index + 1), ocr_pages)):
+                # Keep whatever the text layer had if OCR finds less
+                if len(text.strip()) > len(texts[index].strip()):
+                    texts[index] = text
+                else:
+                    methods[index] = "text"
+
+    docs = []
+    for index, (text, method) in enumerate(zip(texts, methods)):
+        if not text.strip():
+            pdf_pages.inc(method="empty")
+            continue
+
+        pdf_pages.inc(method=method)
+        docs.append(Document(page_content=text, metadata={"source": source, "page": index, "extraction": method}))
+
+    return docs
@@ -0,0 +1,156 @@
+'''
+Batch transcription of infographics (PDF/PNG/JPG, via OCR) and videos (MP4/MOV, via speech recognition).
+
+Run from the backend directory:
+    python -m preprocessing.transcribe infographics transcribed-infographics
+    python -m preprocessing.transcribe video-files transcribed-files --workers 8
+
+Files are transcribed by a process pool (OCR and audio extraction are CPU bound) and a file is skipped when its output is
+newer than the source, or when the manifest shows the source content has not changed since it was last transcribed.
+Outputs are written atomically and failures are appended as JSON lines to <output>/transcribe-errors.jsonl.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from preprocessing.manifest import Manifest, atomic_write, file_digest
+from preprocessing.transcribe_infographics import INFOGRAPHIC_EXTENSIONS, transcribe_infographic, infographic_output_name
+from preprocessing.transcribe_videos import VIDEO_EXTENSIONS, transcribe_video, video_output_name
+
+MANIFEST_NAME = ".transcribe-manifest.json"
+ERROR_LOG_NAME = "transcribe-errors.jsonl"
+
+
+def output_path_for(file_path, output_folder):
+    filename = os.path.basename(file_path)
+    if filename.lower().endswith(VIDEO_EXTENSIONS):
+        return os.path.join(output_folder, video_output_name(filename))
+    return os.path.join(output_folder, infographic_output_name(filename))
+
+
+def is_up_to_date(file_path, output_path, entry):
+    '''
+    Returns a (up_to_date, fingerprint) tuple.
+
+    The output mtime check is free; the source is only hashed when the output is older than the source.
+    '''
+    if not os.path.exists(output_path):
+        return False, None
+
+    if os.path.getmtime(output_path) >= os.path.getmtime(file_path):
+        return True, None
+
+    stat = os.stat(file_path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': file_digest(file_path)}
+    return entry is not None and entry['sha256'] == fingerprint['sha256'], fingerprint
+
+
+def transcribe_file(file_path, output_path, entry, force=False):
+    '''
+    Worker entry point. Transcribes one file unless its output is up to date.
+
+    Returns a result dictionary with the status ("transcribed", "skipped" or "failed"), the elapsed seconds,
+    the source fingerprint to record in the manifest and the error message if any.
+    '''
+    started = time.monotonic()
+    result = {'file': file_path, 'output': output_path, 'fingerprint': None, 'error': None}
+
+    try:
+        if not force:
+            up_to_date, fingerprint = is_up_to_date(file_path, output_path, entry)
+            if up_to_date:
+                return {**result, 'status': 'skipped', 'fingerprint': fingerprint, 'seconds': time.monotonic() - started}
+
+        stat = os.stat(file_path)
+        fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': file_digest(file_path)}
+
+        if file_path.lower().endswith(VIDEO_EXTENSIONS):
+            text = transcribe_video(file_path)
+        else:
+            text = transcribe_infographic(file_path)
+
+        atomic_write(output_path, text)
+        return {**result, 'status': 'transcribed', 'fingerprint': fingerprint, 'seconds': time.monotonic() - started}
+
+    except Exception as e:
+        return {**result, 'status': 'failed', 'error': f"{type(e).__name__}: {e}", 'seconds': time.monotonic() - started}
+
+
+def log_failure(error_log_path, result):
+    record = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'file': result['file'],
+        'error': result['error'],
+        'seconds': round(result['seconds'], 3),
+    }
+    with open(error_log_path, 'a') as error_log:
+        error_log.write(json.dumps(record) + '\n')
+
+
+def transcribe_folder(input_folder, output_folder, workers=None, force=False):
+    '''
+    Transcribes every supported file in input_folder into output_folder using a process pool.
+
+    Returns the list of per-file result dictionaries.
+    '''
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = Manifest(os.path.join(output_folder, MANIFEST_NAME))
+    error_log_path = os.path.join(output_folder, ERROR_LOG_NAME)
+
+    file_paths = sorted(
+        os.path.join(input_folder, filename) for filename in os.listdir(input_folder)
+        if filename.lower().endswith(INFOGRAPHIC_EXTENSIONS + VIDEO_EXTENSIONS)
+    )
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(transcribe_file, file_path, output_path_for(file_path, output_folder),
+                            manifest.get(file_path), force)
+            for file_path in file_paths
+        ]
+
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            if result['status'] == 'failed':
+                log_failure(error_log_path, result)
+            elif result['fingerprint'] is not None:
+                manifest.record(result['file'], result['fingerprint'])
+                manifest.save()
+
+            print(f"{result['status']:>11} {result['seconds']:8.2f}s  {os.path.basename(result['file'])}")
+
+    manifest.save()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a folder of infographics and videos to .txt files.")
+    parser.add_argument("input_folder")
+    parser.add_argument("output_folder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="re-transcribe files even if their output is up to date")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    results = transcribe_folder(args.input_folder, args.output_folder, workers=args.workers, force=args.force)
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('transcribed', 'skipped', 'failed')}
+    busy = sum(r['seconds'] for r in results if r['status'] == 'transcribed')
+    print(f"Transcribed {counts['transcribed']}, skipped {counts['skipped']}, failed {counts['failed']} "
+          f"in {time.monotonic() - started:.1f}s wall ({busy:.1f}s of transcription work)")
+
+    if counts['failed']:
+        print(f"Failures logged to {os.path.join(args.output_folder, ERROR_LOG_NAME)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
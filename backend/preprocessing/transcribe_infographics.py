@@ -1,52 +1,34 @@
-from pdf2image import convert_from_path
 from PIL import Image
 import pytesseract
-import os
 
-input_folder = 'infographics'
-output_folder = 'transcribed-infographics'
+from preprocessing.pdf_extraction import extract_pdf_pages
+
+INFOGRAPHIC_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png')
 
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
 
 def transcribe_image(image):
-    try:
-        text = pytesseract.image_to_string(image)
-        return text
-    except Exception as e:
-        print(f"Error during transcription: {e}")
-        return ""
-
-def process_pdf(pdf_path):
-    images = convert_from_path(pdf_path)
-    full_transcription = ""
-
-    for i, image in enumerate(images):
-        print(f"Transcribing {os.path.basename(pdf_path)} page {i+1}...")
-        transcription = transcribe_image(image)
-        full_transcription += transcription + "\n"
-
-    # save transcription to corresponding txt
-    output_file_path = os.path.join(output_folder, f"{os.path.basename(pdf_path)}.txt")
-    with open(output_file_path, "w") as text_file:
-        text_file.write(full_transcription)
-    # print(f"Saved full transcription for {os.path.basename(pdf_path)}.\n")
-
-for filename in os.listdir(input_folder):
-    file_path = os.path.join(input_folder, filename)
-
-    if filename.endswith(".pdf"):
-        print(f"Processing PDF: {filename}")
-        process_pdf(file_path)
-
-    elif filename.endswith(".jpg") or filename.endswith(".jpeg") or filename.endswith(".png"):
-        # print(f"Processing image: {filename}")
-        with Image.open(file_path) as img:
-            transcription = transcribe_image(img)
-
-        output_file_path = os.path.join(output_folder, f"{filename}.txt")
-        with open(output_file_path, "w") as text_file:
-            text_file.write(transcription)
-        print(f"Saved transcription for {filename}.\n")
-
-print("All files processed and cleaned up.")
\ No newline at end of file
+    return pytesseract.image_to_string(image)
+
+
+def process_pdf(pdf_path, workers=1):
+    '''
+    Returns the text of all pages of a PDF, one page per line block. Only pages without a text layer are OCRed.
+
+    OCR is sequential by default: transcribe.py already runs one file per process.
+    '''
+    return "".join(page.page_content + "\n" for page in extract_pdf_pages(pdf_path, workers=workers))
+
+
+def transcribe_infographic(file_path):
+    '''
+    Returns the OCR transcription of a PDF or image infographic.
+    '''
+    if file_path.lower().endswith(".pdf"):
+        return process_pdf(file_path)
+
+    with Image.open(file_path) as img:
+        return transcribe_image(img)
+
+
+def infographic_output_name(filename):
+    return f"{filename}.txt"
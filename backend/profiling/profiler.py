@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from collections import Counter, deque
+
+from flask import request, g
+
+from metrics.metrics import stage_recorder
+
+# Endpoints that can be profiled (Flask endpoint names)
+PROFILED_ENDPOINTS = set(os.getenv('PROFILE_ENDPOINTS', 'rag_routes.search,processing_routes.add_file').split(','))
+
+# Profiled requests kept in memory, and optionally written to PROFILE_DIR
+PROFILES_KEPT = int(os.getenv('PROFILES_KEPT', 50))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+# Requests carrying this header (set to PROFILING_HEADER_TOKEN) are always profiled
+PROFILE_HEADER = "X-Profile-Request"
+
+
+class ProfilingConfig:
+    '''
+    Runtime profiling settings, changed through the admin endpoint without a redeploy.
+
+    Nothing is sampled while enabled is False: the request hooks return after a single attribute check.
+    '''
+
+    def __init__(self):
+        self.enabled = os.getenv('PROFILING_ENABLED') == '1'
+        self.sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+        self.user_ids = set(filter(None, os.getenv('PROFILE_USER_IDS', '').split(',')))
+        self.header_token = os.getenv('PROFILING_HEADER_TOKEN')
+        self.interval = float(os.getenv('PROFILE_INTERVAL', 0.005))
+        self.max_concurrent = int(os.getenv('PROFILE_MAX_CONCURRENT', 2))
+
+    def to_dict(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "user_ids": sorted(self.user_ids),
+            "interval": self.interval,
+            "max_concurrent": self.max_concurrent,
+        }
+
+    def update(self, data):
+        if "enabled" in data:
+            self.enabled = bool(data["enabled"])
+        if "sample_rate" in data:
+            self.sample_rate = min(max(float(data["sample_rate"]), 0.0), 1.0)
+        if "user_ids" in data:
+            self.user_ids = set(data["user_ids"])
+        if "interval" in data:
+            self.interval = max(float(data["interval"]), 0.001)
+        if "max_concurrent" in data:
+            self.max_concurrent = int(data["max_concurrent"])
+
+
+class StackSampler(threading.Thread):
+    '''
+    Samples the stack of one thread every interval seconds and counts identical stacks.
+
+    The counts are rendered in the collapsed ("folded") format read by flamegraph.pl and speedscope.
+    '''
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name="stack-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+config = ProfilingConfig()
+
+_lock = threading.Lock()
+_active = 0
+_profiles = deque(maxlen=PROFILES_KEPT)
+
+
+def _request_user_id():
+    return request.args.get("user_id") or (request.get_json(silent=True) or {}).get("user_id")
+
+
+def should_profile():
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return False
+    if config.header_token and request.headers.get(PROFILE_HEADER) == config.header_token:
+        return True
+    if config.user_ids and _request_user_id() in config.user_ids:
+        return True
+    return random.random() < config.sample_rate
+
+
+def _start_profile():
+    global _active
+    if not config.enabled or not should_profile():
+        return
+
+    with _lock:
+        if _active >= config.max_concurrent:
+            return
+        _active += 1
+
+    sampler = StackSampler(threading.get_ident(), config.interval)
+    g.profile = {
+        "request_id": request.headers.get("X-Request-ID") or str(uuid.uuid4()),
+        "endpoint": request.endpoint,
+        "user_id": _request_user_id(),
+        "started_at": time.time(),
+        "started": time.perf_counter(),
+        "sampler": sampler,
+        "stages": [],
+    }
+    g.profile["recorder_token"] = stage_recorder.set(g.profile["stages"])
+    sampler.start()
+
+
+def _add_request_id(response):
+    profile = g.get("profile")
+    if profile is not None:
+        response.headers["X-Request-ID"] = profile["request_id"]
+        profile["status"] = response.status_code
+    return response
+
+
+def _finish_profile(error=None):
+    global _active
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+
+    profile["sampler"].stop()
+    stage_recorder.reset(profile["recorder_token"])
+    with _lock:
+        _active -= 1
+
+    record = {
+        "request_id": profile["request_id"],
+        "endpoint": profile["endpoint"],
+        "user_id": profile["user_id"],
+        "started_at": profile["started_at"],
+        "duration": time.perf_counter() - profile["started"],
+        "status": profile.get("status", 500 if error else None),
+        "stages": [{"stage": stage, "seconds": seconds} for stage, seconds in profile["stages"]],
+        "samples": sum(profile["sampler"].samples.values()),
+        "folded": profile["sampler"].folded(),
+    }
+    _profiles.append(record)
+
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f"{record['request_id']}.json"), "w") as f:
+                json.dump(record, f)
+        except OSError as e:
+            print(f"Error saving profile {record['request_id']}: {e}")
+
+
+def list_profiles():
+    return [{key: value for key, value in record.items() if key != "folded"} for record in reversed(_profiles)]
+
+
+def get_profile(request_id):
+    for record in _profiles:
+        if record["request_id"] == request_id:
+            return record
+    return None
+
+
+def init_profiling(app):
+    '''
+    Registers the request hooks that start and stop the sampler around selected requests.
+    '''
+    app.before_request(_start_profile)
+    app.after_request(_add_request_id)
+    app.teardown_request(_finish_profile)
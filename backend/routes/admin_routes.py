@@ -0,0 +1,54 @@
+import os
+import hmac
+from flask import Blueprint, Response, request, jsonify, abort
+
+from profiling.profiler import config, list_profiles, get_profile
+
+admin_routes_bp = Blueprint('admin_routes', __name__)
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+
+@admin_routes_bp.before_request
+def require_admin_token():
+    # The admin endpoints do not exist unless ADMIN_TOKEN is configured
+    if not ADMIN_TOKEN:
+        abort(404)
+
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({ 'error': 'Unauthorized' }), 401
+
+
+@admin_routes_bp.route("/admin/profiles", methods=["GET"])
+def profiles():
+    '''
+    Lists the most recent profiled requests (without their stack samples).
+    '''
+    return jsonify({ 'profiling': config.to_dict(), 'profiles': list_profiles() }), 200
+
+
+@admin_routes_bp.route("/admin/profiles/<request_id>", methods=["GET"])
+def profile(request_id):
+    '''
+    Returns one profiled request. ?format=folded returns the collapsed stacks only, ready for flamegraph.pl or speedscope.
+    '''
+    record = get_profile(request_id)
+    if record is None:
+        return jsonify({ 'error': 'Profile not found' }), 404
+
+    if request.args.get("format") == "folded":
+        return Response(record["folded"] + "\n", mimetype="text/plain")
+    return jsonify(record), 200
+
+
+@admin_routes_bp.route("/admin/profiling", methods=["POST"])
+def update_profiling():
+    '''
+    Changes the profiling settings at runtime, e.g. {"enabled": true, "sample_rate": 0.01, "user_ids": ["42"]}.
+    '''
+    try:
+        config.update(request.get_json() or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({ 'error': str(e) }), 400
+    return jsonify(config.to_dict()), 200
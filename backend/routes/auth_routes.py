@@ -1,14 +1,12 @@
-import os
 from flask import Blueprint, request, jsonify
 
-from database.database import db, User, bcrypt
-from database.pg_vector_store import build_pg_vector_store
-from embeddings.openai_embeddings import openai_embeddings
+from database.database import db, User
+from auth.passwords import hash_password, check_password, needs_rehash
+from auth.session_tokens import issue_session_token
+from admission.admission_control import AdmissionRejected, too_many_requests
 
 auth_routes_bp = Blueprint('auth_routes', __name__)
 
-database_uri = os.getenv("DATABASE_URI")
-
 @auth_routes_bp.route("/signup", methods=['POST'])
 def signup():
     data = request.get_json()
@@ -23,27 +21,25 @@ def signup():
 
     try:
         # Hash the user password before storing it in the db
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = hash_password(password)
 
         new_user = User(name=name, email=email, password=hashed_password)
 
         db.session.add(new_user)
+        # Flushed first so the token can be signed with the new id, and a failure rolls the user back
+        db.session.flush()
+        token = issue_session_token(new_user)
         db.session.commit()
+    except AdmissionRejected as error:
+        return too_many_requests(error)
     except Exception as error:
         db.session.rollback()
         print(error)
         return jsonify({ 'error': "Something went wrong!" }), 500
     
-    # Create a new record in langchain_pg_collection with the collection_name being the id of the user
-    try:
-        collection_name = new_user.id
-        build_pg_vector_store(embeddings_model=openai_embeddings, collection_name=collection_name, connection_uri=database_uri)        
-    except:
-        db.session.rollback()
-        print(error)
-        return jsonify({ 'error': "Something went wrong!" }), 500
+    # The user's vector collection (named after their id) is created on their first upload
 
-    return jsonify({ 'id': new_user.id, "name": new_user.name, "email": new_user.email }), 201
+    return jsonify({ 'id': new_user.id, "name": new_user.name, "email": new_user.email, 'token': token }), 201
 
 @auth_routes_bp.route("/signin", methods=['POST'])
 def signin():
@@ -55,12 +51,26 @@ def signin():
         # Check if a user with the email and password exists, and if not, send an error message
         user = User.query.filter_by(email=email).first()
 
-        if(user is None or not bcrypt.check_password_hash(user.password, password)):
+        if(user is None or not check_password(user.password, password)):
             return jsonify({ 'error': 'Invalid credentials' }), 403
-        
+
+        # Later requests authenticate with this token instead of the password
+        token = issue_session_token(user)
+
+    except AdmissionRejected as error:
+        return too_many_requests(error)
     except Exception as error:
         db.session.rollback()
         print(error)
         return jsonify({ 'error': 'Something went wrong!' }), 500
-        
-    return jsonify({ 'id': user.id, 'name': user.name, 'email': user.email }), 200
\ No newline at end of file
+
+    # Upgrade hashes made with another cost factor while the plain password is at hand
+    if needs_rehash(user.password):
+        try:
+            user.password = hash_password(password)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            print(f"Error rehashing password: {error}")
+
+    return jsonify({ 'id': user.id, 'name': user.name, 'email': user.email, 'token': token }), 200
\ No newline at end of file
@@ -0,0 +1,13 @@
+from flask import Blueprint, Response
+
+from metrics.metrics import registry
+
+metrics_routes_bp = Blueprint('metrics_routes', __name__)
+
+
+@metrics_routes_bp.route("/metrics", methods=["GET"])
+def metrics():
+    '''
+    Exposes the per-stage latency histograms and the error/cache counters in the Prometheus text format.
+    '''
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
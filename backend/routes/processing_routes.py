@@ -1,15 +1,16 @@
 import os
-from flask import Blueprint, request, jsonify
+import json
+import shutil
+import base64
+import contextvars
+from datetime import datetime
+from flask import Blueprint, request, jsonify, make_response
+from sqlalchemy import tuple_
 import tempfile
 
-from supabase import create_client, Client
-
 from embeddings.openai_embeddings import openai_embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders import PyPDFLoader
-from langchain_postgres import PGVector
-from langchain_postgres.vectorstores import PGVector
-from pdf2image import convert_from_path
+from langchain_core.documents import Document
 from PIL import Image
 import pytesseract
 import re
@@ -18,23 +19,55 @@ import speech_recognition as sr
 from moviepy.editor import VideoFileClip
 
 from database.database import db, File, User
+from preprocessing.pdf_extraction import extract_pdf_pages
+from database.pg_vector_store import build_pg_vector_store
+from storage.blob_store import blob_store, blob_path, upload_executor, upload_with_retry, with_retry, remove_many
+from database.file_summary import get_file_summary, record_file_added, invalidate_file_summary, make_etag
+from auth.session_tokens import check_session
+from metrics.metrics import timed, instrument_route
+from admission.admission_control import AdmissionRejected, admission_controlled, upload_admission, upload_user_id
 from custom_models.topic_modelling import predict
 
 processing_routes_bp = Blueprint('processing_routes', __name__)
+processing_routes_bp.before_request(check_session)
 
 database_uri = os.getenv("DATABASE_URI")
-supabase_url = os.getenv('SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_KEY')
-supabase_bucket_name = "user_content"
 
-# connecting to supabase table
-supabase: Client = create_client(supabase_url, supabase_key)
+# /get_file page sizes
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at, file_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), file_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    created_at, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return datetime.fromisoformat(created_at), file_id
+
+
+def etag_response(etag, build_body):
+    '''
+    Returns 304 Not Modified if the client already has this ETag, otherwise builds the JSON body.
+    '''
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify(build_body()), 200)
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 def upload_pdf(user_id, file):
     '''
     Loads vectorized knowledge base embeddings into vector database (PGVector).
 
+    Pages with a text layer are read directly and the others (scanned pages) are OCRed, see extract_pdf_pages.
+    Chunks keep the page they come from in their metadata.
+
     Iterates through knowledge base, calculates 1536 dimensional vector embeddings for each document and stores them in vector database.
 
     Chunk size is currently set to 200 with an overlap of 0. This may have to be adjusted in the future.
@@ -44,33 +77,39 @@ def upload_pdf(user_id, file):
     '''
 
     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(file.read())
+        shutil.copyfileobj(file, tmp)
         tmp_path = tmp.name
 
     # Initialize the text splitter for document chunking
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=200, chunk_overlap=0)
+        chunk_size=200, chunk_overlap=0, add_start_index=True)
 
     # Initialize the vector store with the given user ID as the collection name
-    vector_store = PGVector(
-        embeddings=openai_embeddings,
-        collection_name=user_id,
-        connection=database_uri,
-        use_jsonb=True,
-    )
+    vector_store = build_pg_vector_store(
+        embeddings_model=openai_embeddings, collection_name=user_id, connection_uri=database_uri)
 
     try:
-        # Load and split the document
-        loader = PyPDFLoader(tmp_path)
-        docs = loader.load_and_split(text_splitter=text_splitter)
+        # Extract the text of every page, OCRing only the pages without a text layer
+        pages = extract_pdf_pages(tmp_path, source=file.filename)
 
-        # Add documents to the vector store
-        vector_store.add_documents(docs)
+        # Split the pages into chunks
+        with timed("chunking"):
+            docs = text_splitter.split_documents(pages)
 
-        print(f"Successfully processed and uploaded {file.filename}")
+        # Add documents to the vector store
+        if docs:
+            vector_store.add_documents(docs)
+            print(f"Successfully processed and uploaded {file.filename}")
+        else:
+            print(f"No text could be extracted from {file.filename}")
 
+    except AdmissionRejected:
+        # The global embedding call limit shed this upload, answered with a 429 by admission_controlled
+        raise
     except Exception as e:
+        # Re-raised so add_file removes the uploaded blob and reports the failure instead of storing the file
         print(f"Error processing file {file.filename}: {e}")
+        raise
     finally:
         # Ensure the temporary file is deleted after processing
         try:
@@ -89,39 +128,35 @@ def upload_image(user_id, file):
     Note: This function calls OpenAIEmbeddings() which costs money to run.
     '''
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-        tmp.write(file.read())
+        shutil.copyfileobj(file, tmp)
         tmp_path = tmp.name
 
     # Initialize the text splitter for document chunking
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=200, chunk_overlap=0)
+        chunk_size=200, chunk_overlap=0, add_start_index=True)
 
     # Initialize the vector store with the given user ID as the collection name
-    vector_store = PGVector(
-        embeddings=openai_embeddings,
-        collection_name=user_id,
-        connection=database_uri,
-        use_jsonb=True,
-    )
+    vector_store = build_pg_vector_store(
+        embeddings_model=openai_embeddings, collection_name=user_id, connection_uri=database_uri)
 
     try:
-        full_text = ""
-
-        # Handle PDFs containing images
+        # PDFs go through the same extractor as upload_pdf, so pages with a text layer are not OCRed
         if file.filename.lower().endswith('.pdf'):
-            images = convert_from_path(tmp_path)
-            for image in images:
-                text = pytesseract.image_to_string(image)
-                full_text += text + "\n"
+            pages = extract_pdf_pages(tmp_path, source=file.filename)
 
         # Handle direct image uploads
         elif file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            with Image.open(tmp_path) as img:
+            with timed("ocr"), Image.open(tmp_path) as img:
                 full_text = pytesseract.image_to_string(img)
+            pages = [Document(page_content=full_text, metadata={"source": file.filename})] if full_text.strip() else []
+
+        else:
+            pages = []
 
         # Split the extracted text into chunks
-        if full_text.strip():
-            docs = text_splitter.create_documents([full_text])
+        if pages:
+            with timed("chunking"):
+                docs = text_splitter.split_documents(pages)
 
             # Add documents to the vector store
             vector_store.add_documents(docs)
@@ -129,8 +164,13 @@ def upload_image(user_id, file):
         else:
             print(f"No text could be extracted from {file.filename}")
 
+    except AdmissionRejected:
+        # The global embedding call limit shed this upload, answered with a 429 by admission_controlled
+        raise
     except Exception as e:
+        # Re-raised so add_file removes the uploaded blob and reports the failure instead of storing the file
         print(f"Error processing file {file.filename}: {e}")
+        raise
 
     finally:
         # Ensure the temporary file is deleted after processing
@@ -160,23 +200,20 @@ def upload_video(user_id: str, file):
     # Initialize text splitter for document chunking
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=200,
-        chunk_overlap=0
+        chunk_overlap=0,
+        add_start_index=True
     )
     
     # Initialize vector store
-    vector_store = PGVector(
-        embeddings=openai_embeddings,
-        collection_name=user_id,
-        connection=database_uri,
-        use_jsonb=True,
-    )
+    vector_store = build_pg_vector_store(
+        embeddings_model=openai_embeddings, collection_name=user_id, connection_uri=database_uri)
     
     # Ensure output folder exists
     os.makedirs(output_folder, exist_ok=True)
     
     # Create temporary video file
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_video:
-        tmp_video.write(file.read())
+        shutil.copyfileobj(file, tmp_video)
         video_path = tmp_video.name
         
         try:
@@ -185,24 +222,25 @@ def upload_video(user_id: str, file):
                 temp_audio_path = tmp_audio.name
                 
                 try:
-                    # Extract audio from video
-                    video = VideoFileClip(video_path)
-                    video.audio.write_audiofile(temp_audio_path)
-                    
-                    # Perform transcription
-                    with sr.AudioFile(temp_audio_path) as source:
-                        audio = recognizer.record(source)
-                        try:
-                            text = recognizer.recognize_google(audio)
-                        except sr.UnknownValueError:
-                            text = "Could not understand audio"
-                            # Log failed transcription
-                            with open(f'transcribed-err/{user_id}.txt', 'a') as txt_err_file:
-                                txt_err_file.write(file.filename + '\n')
-                            raise Exception("Could not understand audio")
-                        except sr.RequestError as e:
-                            text = f"Error with the request: {e}"
-                            raise
+                    with timed("transcription"):
+                        # Extract audio from video
+                        video = VideoFileClip(video_path)
+                        video.audio.write_audiofile(temp_audio_path)
+
+                        # Perform transcription
+                        with sr.AudioFile(temp_audio_path) as source:
+                            audio = recognizer.record(source)
+                            try:
+                                text = recognizer.recognize_google(audio)
+                            except sr.UnknownValueError:
+                                text = "Could not understand audio"
+                                # Log failed transcription
+                                with open(f'transcribed-err/{user_id}.txt', 'a') as txt_err_file:
+                                    txt_err_file.write(file.filename + '\n')
+                                raise Exception("Could not understand audio")
+                            except sr.RequestError as e:
+                                text = f"Error with the request: {e}"
+                                raise
                     
                     # Save transcription
                     txt_filename = os.path.splitext(file.filename)[0] + '.txt'
@@ -211,7 +249,8 @@ def upload_video(user_id: str, file):
                         txt_file.write(text)
                     
                     # Create document chunks and add to vector store
-                    docs = text_splitter.create_documents([text], metadatas=[{"source": file.filename}])
+                    with timed("chunking"):
+                        docs = text_splitter.create_documents([text], metadatas=[{"source": file.filename}])
                     vector_store.add_documents(docs)
                     
                     print(f"Successfully processed and uploaded {file.filename}")
@@ -238,11 +277,37 @@ def upload_video(user_id: str, file):
                 print(f"Error cleaning up temporary video file: {cleanup_error}")
 
 
+def timed_upload(path, source_path, content_type):
+    with timed("blob_upload"):
+        return upload_with_retry(blob_store, path, source_path, content_type)
+
+
+def remove_spooled_upload(spool_path):
+    try:
+        os.remove(spool_path)
+    except Exception as cleanup_error:
+        print(f"Error cleaning up temporary file {spool_path}: {cleanup_error}")
+
+
+def discard_blob(upload_future, path):
+    # The path is unique to this request, so only its own blob is removed. This runs even when the upload failed:
+    # an attempt that timed out may still have stored the object
+    try:
+        with_retry(lambda: blob_store.remove([path]))
+    except Exception as e:
+        print(f"Error removing blob {path}: {e}")
+
+
 @processing_routes_bp.route("/upload", methods=["POST"])
+@admission_controlled(upload_admission, upload_user_id)
+@instrument_route("upload")
 def add_file():
     '''
     Receives a file as input and stores it into Supabase blob storage.
     After storing it, it will make an entry into the files table with the link.
+
+    The blob upload runs in the background while the file is extracted and embedded, so the request takes
+    roughly the longer of the two instead of their sum.
     Input:
         1. A file : file that the user wants to add to their database of files
         2. user_id : user id of the user who wants to add a file
@@ -266,46 +331,55 @@ def add_file():
         file_type = file.filename.rsplit('.', 1)[-1].lower()
         content_type = file.content_type or 'application/octet-stream'
 
-        if (content_type == 'image/png'):
-            upload_image(user_id, file)
-        elif (content_type == 'application/pdf'):
-            upload_pdf(user_id, file)
-        elif(content_type == 'video/mp4'):
-            upload_video(user_id, file)
-            
-        else:
-            return jsonify({"error": "File format not supported"}), 400
+        ingest = {
+            'image/png': upload_image,
+            'application/pdf': upload_pdf,
+            'video/mp4': upload_video,
+        }.get(content_type)
 
-        # Create a temporary file to handle the upload
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            file.save(temp_file.name)
+        if ingest is None:
+            return jsonify({"error": "File format not supported"}), 400
 
-            # Upload to Supabase with proper content-type
-            with open(temp_file.name, 'rb') as f:
-                response = supabase.storage.from_(supabase_bucket_name).upload(
-                    file=f,
-                    path=file.filename,
-                    file_options={"content-type": content_type}
-                )
+        # Spool the file to disk once for the blob upload, so large videos are never held in memory.
+        # The ingestion helpers read it again from the start
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as spool:
+            file.save(spool)
+            spool_path = spool.name
+        file.seek(0)
+        size = os.path.getsize(spool_path)
+
+        # Upload to blob storage in the background while the file is extracted and embedded
+        # Run in a copy of the request context so a profiled request also records the upload stage
+        path = blob_path(user_id, file.filename)
+        upload_future = upload_executor.submit(
+            contextvars.copy_context().run, timed_upload, path, spool_path, content_type)
+        # The upload may still be running when ingestion fails, so the spooled file is removed once it is done
+        upload_future.add_done_callback(lambda future: remove_spooled_upload(spool_path))
 
-        # Clean up temporary file
-        os.unlink(temp_file.name)
+        try:
+            ingest(user_id, file)
+        except BaseException:
+            # Don't leave an orphaned blob behind when ingestion fails
+            upload_future.add_done_callback(lambda future: discard_blob(future, path))
+            raise
 
         # Retrieve the public URL
-        public_url = supabase.storage.from_(
-            supabase_bucket_name).get_public_url(file.filename)
+        public_url = upload_future.result()
 
         # Add entry to the files table
         new_file = File(
             url=public_url,
             name=file.filename,
+            path=path,
             type=file_type,
+            size=size,
             user_id=user_id
         )
 
         # Add the new file to the session and commit
         db.session.add(new_file)
         db.session.commit()
+        record_file_added(user_id, new_file)
 
         print("/user-add-file successfully added a file to the database")
         return jsonify({
@@ -313,6 +387,9 @@ def add_file():
             "file_id": new_file.id
         }), 200
 
+    except AdmissionRejected:
+        # Answered with a 429 by admission_controlled
+        raise
     except Exception as e:
         print("Error @ /user-add-file ||", e)
         return jsonify({
@@ -324,10 +401,16 @@ def add_file():
 @processing_routes_bp.route("/get_file", methods=["GET"])
 def get_file():
     '''
-    Given a user_id, all associated urls and their corresponding file names will be returned.
+    Given a user_id, the associated urls and their corresponding file names will be returned, newest first.
+
+    Without limit and cursor, all of the user's files are returned. Otherwise results are keyset paginated: when more
+    files exist, the X-Next-Cursor header holds the cursor of the next page.
+    Responses carry an ETag derived from the user's file summary, so polling clients get a 304 when nothing changed.
 
     Input: 
         1. user_id : user id of the user whose files and urls need to be retrieved
+        2. limit (optional, default: 100 when a cursor is given, max: 500) : the number of files per page
+        3. cursor (optional) : the X-Next-Cursor value of the previous page
     '''
 
     try:
@@ -337,13 +420,40 @@ def get_file():
 
         # access the user id
         user_id = request.args['user_id']
+        cursor = request.args.get('cursor')
 
-        # retrieve all associated URLs and file names and turn it into a list of dicts
-        files = db.session.query(File.url, File.name, File.type).filter(
-            File.user_id == user_id).all()
-        results = [{"url": file.url, "name": file.name, "type": file.type} for file in files]
-
-        return jsonify(results), 200
+        # input validation: limit and cursor
+        # Clients that predate pagination send neither and get the full list
+        paginated = 'limit' in request.args or cursor is not None
+        try:
+            limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE) if paginated else None
+            after = decode_cursor(cursor) if cursor else None
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+        if paginated and limit < 1:
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+
+        # The summary changes whenever a file is added or deleted, so the page can be answered from it
+        etag = make_etag([get_file_summary(user_id)["etag"], cursor, limit])
+        if request.if_none_match.contains(etag):
+            return etag_response(etag, None)
+
+        # retrieve the URLs and file names (one page when paginated) and turn them into a list of dicts
+        query = db.session.query(File.id, File.url, File.name, File.type, File.created_at).filter(
+            File.user_id == user_id)
+        if after:
+            query = query.filter(tuple_(File.created_at, File.id) < after)
+        query = query.order_by(File.created_at.desc(), File.id.desc())
+        files = query.limit(limit + 1).all() if paginated else query.all()
+
+        results = [{"url": file.url, "name": file.name, "type": file.type} for file in files[:limit]]
+        response = etag_response(etag, lambda: results)
+
+        if paginated and len(files) > limit:
+            last = files[limit - 1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last.created_at, last.id)
+
+        return response
 
     except Exception as e:
         print("Error @ /user-get-file ||", e)
@@ -377,13 +487,18 @@ def delete_file():
         # access the filename
         filename = request.args['filename']
 
-        # perform deletion on supabase
-        supabase.storage.from_(supabase_bucket_name).remove([filename])
+        # perform deletion on blob storage, only of this user's blobs
+        files = db.session.query(File.path, File.name).filter(File.name == filename,
+                                                              File.user_id == user_id).all()
+        paths = [file.path or file.name for file in files]
+        if paths:
+            with_retry(lambda: blob_store.remove(paths))
 
         # perform deletion on the file table
         db.session.query(File).filter(File.name == filename,
                                       File.user_id == user_id).delete()
         db.session.commit()
+        invalidate_file_summary(user_id)
 
         return jsonify({"status": "successful"}), 200
 
@@ -411,16 +526,15 @@ def delete_all_file():
         # access the user id
         user_id = request.args['user_id']
 
-        # identify the filenames of all the files that belong to user_id user
-        file_names = db.session.query(File.name).filter(
+        # identify the blob paths of all the files that belong to user_id user
+        files = db.session.query(File.path, File.name).filter(
             File.user_id == user_id).all()
-        names = [file.name for file in file_names]
+        paths = [file.path or file.name for file in files]
 
-        print(names)
+        print(paths)
 
-        # delete each file from supabase
-        for name in names:
-            supabase.storage.from_(supabase_bucket_name).remove([name])
+        # delete the files from blob storage in concurrent batches
+        remove_many(blob_store, paths)
 
         # access the user id
         user_id = request.args['user_id']
@@ -428,6 +542,7 @@ def delete_all_file():
         # perform deletion on the file table
         db.session.query(File).filter(File.user_id == user_id).delete()
         db.session.commit()
+        invalidate_file_summary(user_id)
 
         return jsonify({"status": "successful"}), 200
 
@@ -491,19 +606,28 @@ def get_data_distribution():
 
     # access the user id
     user_id = request.args['user_id']
-    user = User.query.filter_by(id=user_id).first()
-
-    files = db.session.query(File).filter(File.user_id == user_id).all()
-
-    # Initialize dictionary to count file types
-    type_dict = {}
+    summary = get_file_summary(user_id)
 
     # Count occurrences of each file type
     possible_file_types = ['png', 'pdf', 'jpg', 'jpeg', 'mp4', 'mov']
-    pftdict = {file_type: 0 for file_type in possible_file_types}
+    pftdict = {file_type: summary["counts"].get(file_type, 0) for file_type in possible_file_types}
+
+    return etag_response(summary["etag"], lambda: pftdict)
+
+
+@processing_routes_bp.route("/get-file-summary", methods=["GET"])
+def get_file_summary_route():
+    '''
+    Given a user_id, get the user's file counts by type, total bytes and most recent files
+
+    Input: 
+        1. user_id : user id of the user 
+    '''
+
+    # input validation: user_id
+    if 'user_id' not in request.args:
+        return jsonify({"error": "No user_id provided in the request"}), 400
 
-    for file in files:
-        if file.type in possible_file_types:
-            pftdict[file.type] += 1
+    summary = get_file_summary(request.args['user_id'])
 
-    return jsonify(pftdict), 200  
\ No newline at end of file
+    return etag_response(summary["etag"], lambda: {key: value for key, value in summary.items() if key != "etag"})
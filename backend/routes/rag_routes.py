@@ -4,18 +4,28 @@ from flask import Blueprint, request, jsonify
 from embeddings.openai_embeddings import openai_embeddings
 from database.pg_vector_store import build_pg_vector_store
 from chains.conversational_retrieval_chain_with_memory import build_conversational_retrieval_chain_with_memory
-from langchain.chat_models import ChatOpenAI
+from chains.limited_chat_openai import LimitedChatOpenAI
 
 from database.database import db, File, User
+from auth.session_tokens import check_session
+from metrics.metrics import timed, instrument_route
+from admission.admission_control import admission_controlled, search_admission, search_user_id
 
 rag_routes_bp = Blueprint('rag_routes', __name__)
+rag_routes_bp.before_request(check_session)
 
 database_uri = os.getenv("DATABASE_URI")
 
-llm = ChatOpenAI()
+llm = LimitedChatOpenAI()
+
+# Optional smaller/faster model used only to condense follow-up questions
+condense_question_model = os.getenv("CONDENSE_QUESTION_MODEL")
+condense_question_llm = LimitedChatOpenAI(model=condense_question_model, temperature=0) if condense_question_model else llm
 
 
 @rag_routes_bp.route("/search", methods=['POST'])
+@admission_controlled(search_admission, search_user_id)
+@instrument_route("search")
 def search():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -30,7 +40,7 @@ def search():
 
     # Create the retrieval QA chain
     retrieval_qa_chain = build_conversational_retrieval_chain_with_memory(
-        llm, pg_vector_retriever, conversation_id)
+        llm, pg_vector_retriever, conversation_id, condense_question_llm=condense_question_llm)
 
     # Run the query
     result = retrieval_qa_chain.run(query)
@@ -45,10 +55,11 @@ def search():
     }
 
     #adding every user query to the associated users array of queries
-    user = User.query.filter_by(id=user_id).first() 
-    user.message_ids = (user.message_ids or []) + [query]
+    with timed("user_update"):
+        user = User.query.filter_by(id=user_id).first() 
+        user.message_ids = (user.message_ids or []) + [query]
 
-    # Commit the changes to the database
-    db.session.commit()
+        # Commit the changes to the database
+        db.session.commit()
 
     return jsonify(response)
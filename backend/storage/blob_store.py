@@ -0,0 +1,176 @@
+import os
+import time
+import shutil
+import uuid
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from supabase import create_client
+from storage3.utils import StorageException
+
+from metrics.metrics import errors
+
+# Removals are sent in batches of this many paths, with this many batches in flight
+REMOVE_BATCH_SIZE = int(os.getenv('BLOB_REMOVE_BATCH_SIZE', 100))
+REMOVE_CONCURRENCY = int(os.getenv('BLOB_REMOVE_CONCURRENCY', 4))
+
+# Blob uploads run on this pool while the request thread extracts and embeds the file
+upload_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BLOB_UPLOAD_WORKERS', 8)), thread_name_prefix="blob-upload")
+
+
+class BlobStoreError(Exception):
+    pass
+
+
+def is_transient(error):
+    '''
+    True for failures worth retrying: timeouts, connection errors, rate limiting and 5xx answers.
+
+    Other errors, such as Supabase's "Duplicate" conflict, would fail the same way again.
+    '''
+    while error is not None:
+        if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError)):
+            return True
+        if isinstance(error, StorageException):
+            details = error.args[0] if error.args and isinstance(error.args[0], dict) else {}
+            try:
+                status = int(details.get("statusCode", 0))
+            except (TypeError, ValueError):
+                return False
+            return status == 429 or status >= 500
+        # storage3 raises while handling the httpx error, so a timeout can be the context of what it raises
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def with_retry(operation, attempts=4, base_delay=0.2):
+    '''
+    Calls operation(), retrying transient failures with exponential backoff and jitter. Other failures and the last
+    transient one are re-raised.
+    '''
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient(e):
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+
+def blob_path(user_id, filename):
+    '''
+    Returns a new blob path for an upload. The path is unique to the upload, so it never replaces another user's (or
+    another upload's) blob of the same name.
+    '''
+    return f"{user_id}/{uuid.uuid4().hex}-{filename}"
+
+
+class SupabaseBlobStore:
+    '''
+    Blob store backed by a Supabase storage bucket.
+    '''
+
+    def __init__(self, url, key, bucket_name):
+        self.client = create_client(url, key)
+        self.bucket_name = bucket_name
+
+    def upload(self, path, source_path, content_type, upsert=False):
+        # Streamed from the local file rather than read into memory
+        with open(source_path, 'rb') as f:
+            self.client.storage.from_(self.bucket_name).upload(
+                path=path,
+                file=f,
+                file_options={"content-type": content_type, "upsert": "true" if upsert else "false"}
+            )
+
+    def public_url(self, path):
+        return self.client.storage.from_(self.bucket_name).get_public_url(path)
+
+    def remove(self, paths):
+        self.client.storage.from_(self.bucket_name).remove(list(paths))
+
+
+class LocalBlobStore:
+    '''
+    Filesystem stand-in for the blob store, for local development and tests (BLOB_STORE=local).
+    '''
+
+    def __init__(self, root, base_url=None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url
+
+    def _full_path(self, path):
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep):
+            raise BlobStoreError(f"Invalid blob path {path}")
+        return full_path
+
+    def upload(self, path, source_path, content_type, upsert=False):
+        full_path = self._full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        shutil.copyfile(source_path, full_path)
+
+    def public_url(self, path):
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{path}"
+        return f"file://{self._full_path(path)}"
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(self._full_path(path))
+            except FileNotFoundError:
+                pass
+
+
+def upload_with_retry(blob_store, path, source_path, content_type):
+    '''
+    Uploads the local file source_path to a path from blob_path with retries. Only the first attempt refuses to overwrite an existing blob: a
+    failed attempt (e.g. a timeout) may still have stored the object, and as the path belongs to this upload the
+    retries can safely upsert it rather than fail with "Duplicate".
+    '''
+    attempts = []
+
+    def upload():
+        attempts.append(None)
+        blob_store.upload(path, source_path, content_type, upsert=len(attempts) > 1)
+
+    with_retry(upload)
+    return blob_store.public_url(path)
+
+
+def remove_many(blob_store, paths):
+    '''
+    Removes paths in batches of REMOVE_BATCH_SIZE, REMOVE_CONCURRENCY batches at a time, retrying each batch with backoff.
+
+    Raises BlobStoreError listing the paths that could not be removed.
+    '''
+    paths = list(paths)
+    batches = [paths[i:i + REMOVE_BATCH_SIZE] for i in range(0, len(paths), REMOVE_BATCH_SIZE)]
+    if not batches:
+        return
+
+    def remove_batch(batch):
+        try:
+            with_retry(lambda: blob_store.remove(batch))
+            return []
+        except Exception as e:
+            errors.inc(where="blob_remove")
+            print(f"Error removing {len(batch)} blobs: {e}")
+            return batch
+
+    with ThreadPoolExecutor(max_workers=min(REMOVE_CONCURRENCY, len(batches))) as executor:
+        failed = [path for batch_failures in executor.map(remove_batch, batches) for path in batch_failures]
+
+    if failed:
+        raise BlobStoreError(f"Could not remove {len(failed)} blobs: {failed[:10]}")
+
+
+def build_blob_store():
+    if os.getenv('BLOB_STORE') == 'local':
+        return LocalBlobStore(os.getenv('LOCAL_BLOB_ROOT', 'blob-store'), os.getenv('LOCAL_BLOB_BASE_URL'))
+    return SupabaseBlobStore(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'), "user_content")
+
+
+blob_store = build_blob_store()
@@ -0,0 +1,76 @@
+from langchain_core.documents import Document
+
+from chains.context_packing import merge_neighbours, pack_context, count_tokens
+
+
+def chunk(text, start, source="notes.txt", page=None):
+    metadata = {"start_index": start}
+    if source is not None:
+        metadata["source"] = source
+    if page is not None:
+        metadata["page"] = page
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_merges_adjacent_and_overlapping_chunks():
+    text = "alpha beta gamma delta epsilon"
+    docs = [chunk(text[11:], 11), chunk(text[:16], 0)]
+
+    merged = merge_neighbours(docs)
+
+    assert [doc.page_content for doc in merged] == [text]
+    assert merged[0].metadata["start_index"] == 0
+
+
+def test_joins_chunks_separated_by_stripped_whitespace():
+    merged = merge_neighbours([chunk("alpha beta", 0), chunk("gamma", 11)])
+
+    assert [doc.page_content for doc in merged] == ["alpha beta gamma"]
+
+
+def test_does_not_merge_chunks_without_source():
+    docs = [chunk("alpha beta gamma", 0, source=None), chunk("other text here", 0, source=None),
+            chunk("elon", 17, source=None)]
+
+    merged = merge_neighbours(docs)
+
+    assert [doc.page_content for doc in merged] == ["alpha beta gamma", "other text here", "elon"]
+
+
+def test_does_not_merge_overlaps_whose_text_differs():
+    # Same source and offsets, but from two different versions of the file
+    docs = [chunk("alpha beta gamma", 0), chunk("other text here", 10)]
+
+    merged = merge_neighbours(docs)
+
+    assert [doc.page_content for doc in merged] == ["alpha beta gamma", "other text here"]
+
+
+def test_keeps_pages_and_distant_chunks_apart_in_relevance_order():
+    docs = [chunk("far away", 500), chunk("first page", 0, page=0), chunk("second page", 0, page=1)]
+
+    merged = merge_neighbours(docs)
+
+    assert [doc.page_content for doc in merged] == ["far away", "first page", "second page"]
+
+
+def test_pack_context_drops_duplicates_and_respects_budget():
+    first = "the quick brown fox jumps over the lazy dog " * 5
+    docs = [
+        chunk(first, 0, source="a.txt"),
+        chunk(first, 0, source="b.txt"),
+        chunk("completely different words about vector databases " * 5, 0, source="c.txt"),
+    ]
+    budget = count_tokens(docs[0].page_content) + 5
+
+    packed = pack_context(docs, max_tokens=budget)
+
+    assert [doc.metadata["source"] for doc in packed] == ["a.txt"]
+    assert sum(count_tokens(doc.page_content) for doc in packed) <= budget
+
+
+def test_pack_context_truncates_a_single_oversized_document():
+    packed = pack_context([chunk("word " * 500, 0)], max_tokens=20)
+
+    assert len(packed) == 1
+    assert count_tokens(packed[0].page_content) <= 20
@@ -0,0 +1,83 @@
+import io
+
+import numpy as np
+import pytest
+
+from database.snapshots import SnapshotWriter, SnapshotError, read_snapshot, verify_snapshot, _vector_literal
+
+
+def write_snapshot(batches):
+    '''
+    Returns the snapshot bytes and the offset of the footer frame.
+    '''
+    f = io.BytesIO()
+    writer = SnapshotWriter(f)
+    writer.write_header({"version": 1, "collection": "notes", "dimensions": 3})
+    for batch in batches:
+        writer.write_batch(*batch)
+    footer_offset = f.tell()
+    writer.close()
+    return f.getvalue(), footer_offset
+
+
+def batches():
+    rng = np.random.default_rng(0)
+    return [
+        (["a", "b"], ["first", "second"], [{"source": "x.pdf", "page": 0}, {}], rng.standard_normal((2, 3))),
+        (["c"], ["third"], [{"source": "y.txt"}], rng.standard_normal((1, 3))),
+    ]
+
+
+def test_round_trip():
+    data, _ = write_snapshot(batches())
+
+    items = list(read_snapshot(io.BytesIO(data)))
+
+    assert items[0] == ("header", {"version": 1, "collection": "notes", "dimensions": 3})
+    assert len(items) == 3
+    for (kind, (ids, documents, metadatas, vectors)), expected in zip(items[1:], batches()):
+        assert kind == "batch"
+        assert (ids, documents, metadatas) == expected[:3]
+        assert vectors.dtype == np.float32
+        np.testing.assert_array_equal(vectors, expected[3].astype(np.float32))
+
+
+def test_verify_counts_rows():
+    data, _ = write_snapshot(batches())
+
+    header, rows = verify_snapshot(io.BytesIO(data))
+
+    assert header["collection"] == "notes"
+    assert rows == 3
+
+
+def test_flipped_byte_raises():
+    data, footer_offset = write_snapshot(batches())
+    corrupted = bytearray(data)
+    # Last byte of the last vectors frame
+    corrupted[footer_offset - 1] ^= 0xFF
+
+    with pytest.raises(SnapshotError):
+        list(read_snapshot(io.BytesIO(bytes(corrupted))))
+
+
+def test_missing_footer_raises():
+    data, footer_offset = write_snapshot(batches())
+
+    with pytest.raises(SnapshotError):
+        list(read_snapshot(io.BytesIO(data[:footer_offset])))
+
+
+def test_not_a_snapshot_raises():
+    with pytest.raises(SnapshotError):
+        list(read_snapshot(io.BytesIO(b"not a snapshot")))
+
+
+def test_vector_literal_round_trips_float32():
+    vector = np.random.default_rng(1).standard_normal(64).astype(np.float32)
+    vector[:3] = [np.float32(1e-38), np.float32(3.4e38), np.float32(-0.0)]
+
+    literal = _vector_literal(vector)
+    parsed = np.array([float(value) for value in literal.strip("[]").split(",")], dtype=np.float32)
+
+    np.testing.assert_array_equal(parsed, vector)